@@ -21,13 +21,39 @@ TC_XML_FILENAME = 'testcases.xml'
 OUTPUT_DIR = None
 TEST_NAME = None
 LOG_MSGS = False
+TRACE_SAMPLE = 1  # -l/--log_msgs logs every Nth request of each agent.  0 turns it off
+TRACE_ERRORS_ONLY = False  # only log the messages of failed requests
+TRACE_SLOWER_THAN = 0  # secs.  >0 only logs the messages of requests that took at least this long (or failed, with TRACE_ERRORS_ONLY)
+TRACE_BODY_LIMIT = 0  # bytes.  >0 cuts logged response bodies to this size
+TRACE_COMPRESS = False  # write the message logs gzip compressed (agent_N.log.gz)
+ENGINE = 'threads'  # 'threads' runs one OS thread per agent.  'events' runs all agents on a single non-blocking event loop
+WORKER_PROCESSES = 1  # >1 shards the agents across this many processes to use more cores (not on Windows)
+ARRIVAL_RATE = 0  # req/sec.  >0 switches to an open workload model: requests are sent at this rate by free agents, however slow the responses
 
 GENERATE_RESULTS = True
 SHUFFLE_TESTCASES = False  # randomize order of testcases per agent
 WAITFOR_AGENT_FINISH = True  # wait for last requests to complete before stopping
 SMOOTH_TP_GRAPH = 1  # secs.  smooth/dampen throughput graph based on an interval
+GRAPH_PROCESSES = 3  # graphs are drawn in this many worker processes, while the html report is written.  0 draws them in the results thread
+EXACT_PERCENTILES = False  # report percentiles from every response time instead of a histogram with 1% precision (needs much more memory)
 SOCKET_TIMEOUT = 300  # secs
 COOKIES_ENABLED = True
+RESULTS_QUEUE_SIZE = 100000  # results waiting to be written to agent_stats.csv.  0 is unbounded
+RESULTS_QUEUE_FULL = 'block'  # when the results queue is full: 'block' holds the agents until the writer catches up, 'drop' discards (and counts) results
+RESULTS_FLUSH_INTERVAL = 1  # secs.  how often agent_stats.csv is flushed to disk
+RESULTS_FORMAT = 'csv'  # 'csv' (agent_stats.csv), 'binary' (compact column files, see core/resultstore.py) or 'both'
+ROLLUP_INTERVAL = 0  # secs.  >0 sums the results up per interval and timer group in rollups.dat as the test runs.  the report is built from them
+RAW_RESULTS = True  # log every request in RESULTS_FORMAT.  False keeps only the rollups, for very high request rates (needs ROLLUP_INTERVAL > 0)
+ARRIVAL_POISSON = False  # open model only.  exponentially distributed gaps between requests instead of a constant rate
+LATE_DISPATCH = 0.01  # secs.  open model only.  a request sent this far behind its schedule is reported as late
+VERIFY_STREAM_LIMIT = 0  # bytes.  >0 verifies bodies as they arrive and stops reading once the verify pattern is found or this much was read
+DISCARD_BODIES = False  # read response bodies in chunks and only count their bytes, unless verification or trace logging needs them
+KEEPALIVE = False  # reuse persistent HTTP/1.1 connections (one pool per agent)
+KEEPALIVE_MAX_IDLE = 30  # secs.  pooled connections idle longer than this are closed and reopened
+DNS_CACHE_TTL = 60  # secs.  host name lookups are shared by the agents of a process and kept this long.  0 resolves every connection
+TLS_SESSION_CACHE = False  # agents resume their TLS sessions when they reconnect.  needs pyOpenSSL, which then does all TLS handshakes
+TLS_CA_FILE = None  # PEM file of the CA certificates to trust instead of the system ones, e.g. a test server's self-signed certificate
+DNS_PINS = {}  # host -> IP addresses used instead of resolving it, in turn.  e.g. {'www.example.com': ['10.0.0.1', '10.0.0.2']}
 
 HTTP_DEBUG = False  # only useful when combined with blocking mode  
 BLOCKING = False  # stdout blocked until test finishes, then result is returned as XML
@@ -0,0 +1,283 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Persistent HTTP/1.1 connection pool.  Each agent owns one pool, so
+#  connections are never shared between threads and no locking is needed.
+#  The connections time name resolution, the TCP connect and the TLS handshake
+#  into the agent's timing.Phases, and resume the agent's TLS sessions (see
+#  core/tlssession.py).  urllib2 openers use them through TimedHTTPHandler and
+#  TimedHTTPSHandler.
+
+
+import httplib
+import socket
+import time
+import urllib2
+import urlparse
+import config
+import dnscache
+import tlssession
+from timing import Phases, timer
+
+
+
+HTTP_DEBUG = config.HTTP_DEBUG  # default is False
+MAX_REDIRECTS = 10  # same limit as urllib2.HTTPRedirectHandler
+
+
+
+class ConnectionPool:
+    def __init__(self, max_idle=config.KEEPALIVE_MAX_IDLE, phases=None, tls_sessions=None):
+        self.max_idle = max_idle  # secs a connection may sit idle before we stop trusting it
+        self.phases = phases or Phases()  # setup times of new connections go here
+        self.tls_sessions = tls_sessions or tlssession.SessionCache()
+        self.idle = {}  # (scheme, host, port) -> (connection, last used time)
+        self.reused_connections = 0
+
+
+    def get(self, scheme, host, port):
+        # returns (connection, is_reused)
+        key = (scheme, host, port)
+        entry = self.idle.pop(key, None)
+        if entry:
+            conn, last_used = entry
+            if (time.time() - last_used) <= self.max_idle:
+                self.reused_connections += 1
+                return (conn, True)
+            conn.close()  # idle too long, the server has probably dropped it
+        if scheme == 'https':
+            conn = TimedHTTPSConnection(self.phases, self.tls_sessions, host, port)
+        else:
+            conn = TimedHTTPConnection(self.phases, host, port)
+        if HTTP_DEBUG:
+            conn.set_debuglevel(1)
+        return (conn, False)
+
+
+    def put(self, scheme, host, port, conn):
+        key = (scheme, host, port)
+        old = self.idle.get(key)
+        if old and old[0] is not conn:
+            old[0].close()
+        self.idle[key] = (conn, time.time())
+
+
+    def close(self):
+        for conn, last_used in self.idle.values():
+            conn.close()
+        self.idle = {}
+
+
+    def open(self, request, cookie_jar=None):
+        # send a urllib2.Request over a pooled connection.
+        # behaves like an urllib2 opener: follows redirects, handles cookies,
+        # raises urllib2.HTTPError for status >= 400 and urllib2.URLError for socket errors.
+        for redirect in range(MAX_REDIRECTS + 1):
+            if cookie_jar is not None:
+                cookie_jar.add_cookie_header(request)
+            resp = self.send(request)
+            if cookie_jar is not None:
+                cookie_jar.extract_cookies(resp, request)
+            location = resp.headers.get('location') or resp.headers.get('uri')
+            if resp.code in (301, 302, 303, 307) and location:
+                resp.read()  # drain so the connection goes back to the pool
+                request = redirect_request(request, resp.code, location)
+                continue
+            if resp.code >= 400:
+                resp.read()
+                raise urllib2.HTTPError(request.get_full_url(), resp.code, resp.msg, resp.headers, None)
+            return resp
+        raise urllib2.HTTPError(request.get_full_url(), resp.code, 'redirect loop', resp.headers, None)
+
+
+    def send(self, request):
+        scheme = request.get_type()
+        host, port = urllib2.splitport(request.get_host())
+        if port:
+            port = int(port)
+        else:
+            port = httplib.HTTPS_PORT if scheme == 'https' else httplib.HTTP_PORT
+        headers = dict(request.header_items())
+
+        conn, is_reused = self.get(scheme, host, port)
+        try:
+            try:
+                conn.request(request.get_method(), request.get_selector(), request.get_data(), headers)
+                resp = conn.getresponse()
+            except (httplib.BadStatusLine, socket.error):
+                if not is_reused:
+                    raise
+                # the server closed the idle connection under us.  retry once on a fresh one
+                conn.close()
+                conn, is_reused = self.get(scheme, host, port)
+                conn.request(request.get_method(), request.get_selector(), request.get_data(), headers)
+                resp = conn.getresponse()
+        except socket.error, e:
+            conn.close()
+            raise urllib2.URLError(e)
+        except httplib.HTTPException:
+            conn.close()
+            raise
+        return PooledResponse(self, (scheme, host, port), conn, resp)
+
+
+
+
+class PooledResponse:
+    # looks like the response returned by an urllib2 opener.
+    # the connection is handed back to its pool once the body has been read.
+    def __init__(self, pool, key, conn, resp):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.resp = resp
+        self.code = resp.status
+        self.msg = resp.reason
+        self.headers = resp.msg  # httplib.HTTPMessage
+
+
+    def info(self):
+        return self.headers
+
+
+    def read(self, amt=None):
+        try:
+            content = self.resp.read(amt)
+        except (httplib.HTTPException, socket.error):
+            self.conn.close()
+            raise
+        if amt is None or self.resp.isclosed():  # httplib closes the response once the body is done
+            self.release()
+        return content
+
+
+    def close(self):
+        # stop reading early.  the rest of the body is still on the wire, so the connection can't be reused
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+    def release(self):
+        if self.conn is None:
+            return
+        if self.resp.will_close:
+            self.conn.close()
+        else:
+            scheme, host, port = self.key
+            self.pool.put(scheme, host, port, self.conn)
+        self.conn = None
+
+
+
+
+class TimedHTTPConnection(httplib.HTTPConnection):
+    # an HTTPConnection that adds its name resolution and connect times to phases
+    def __init__(self, phases, host, port=None, **kwargs):
+        httplib.HTTPConnection.__init__(self, host, port, **kwargs)
+        self.phases = phases
+
+    def connect(self):
+        self.sock = open_socket(self, self.phases)
+        self.phases.connections += 1
+        if self._tunnel_host:
+            self._tunnel()
+
+
+
+
+class TimedHTTPSConnection(httplib.HTTPSConnection):
+    # an HTTPSConnection that adds its name resolution, connect and handshake times to phases,
+    # and resumes the TLS session it had with the server last time
+    def __init__(self, phases, tls_sessions, host, port=None, **kwargs):
+        context = tlssession.stdlib_context()
+        if context is not None:
+            kwargs['context'] = context  # shared, httplib would make a new one for every connection
+        httplib.HTTPSConnection.__init__(self, host, port, **kwargs)
+        self.phases = phases
+        self.tls_sessions = tls_sessions
+
+    def connect(self):
+        # same as httplib.HTTPSConnection.connect
+        self.sock = open_socket(self, self.phases)
+        self.phases.connections += 1
+        if self._tunnel_host:
+            self._tunnel()
+            server_hostname = self._tunnel_host
+        else:
+            server_hostname = self.host
+        handshake_start = timer()
+        self.sock = self.tls_sessions.wrap_socket(self.sock, server_hostname, self.port, getattr(self, '_context', None))
+        self.phases.tls += timer() - handshake_start
+        self.phases.count_handshake(tlssession.is_resumed(self.sock))
+
+
+
+
+class TimedHTTPHandler(urllib2.HTTPHandler):
+    def __init__(self, phases, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.phases = phases
+
+    def http_open(self, req):
+        return self.do_open(lambda host, **kwargs: TimedHTTPConnection(self.phases, host, **kwargs), req)
+
+
+
+
+class TimedHTTPSHandler(urllib2.HTTPSHandler):
+    def __init__(self, phases, tls_sessions, debuglevel=0):
+        urllib2.HTTPSHandler.__init__(self, debuglevel)
+        self.phases = phases
+        self.tls_sessions = tls_sessions
+
+    def https_open(self, req):
+        return self.do_open(lambda host, **kwargs: TimedHTTPSConnection(self.phases, self.tls_sessions, host, **kwargs), req)
+
+
+
+
+def open_socket(conn, phases):
+    # socket.create_connection for an httplib connection, with name resolution and connect timed separately
+    start = timer()
+    addrs, is_hit = dnscache.cache.getaddrinfo(conn.host, conn.port)
+    resolved = timer()
+    phases.dns += resolved - start
+    phases.count_lookup(is_hit)
+    try:
+        error = socket.error('getaddrinfo returns an empty list')
+        for family, socktype, proto, canonname, addr in addrs:
+            sock = socket.socket(family, socktype, proto)
+            try:
+                if conn.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(conn.timeout)
+                if conn.source_address:
+                    sock.bind(conn.source_address)
+                sock.connect(addr)
+                return sock
+            except socket.error, e:
+                error = e
+                sock.close()
+        raise error
+    finally:
+        phases.connect += timer() - resolved
+
+
+def redirect_request(request, code, location):
+    # build the follow-up urllib2.Request for a redirect, the same way urllib2.HTTPRedirectHandler does
+    new_url = urlparse.urljoin(request.get_full_url(), location)
+    headers = dict((k, v) for k, v in request.headers.items()
+        if k.lower() not in ('content-length', 'content-type', 'cookie'))
+    if code == 307:
+        return urllib2.Request(new_url, request.get_data(), headers)
+    return urllib2.Request(new_url, None, headers)  # 301/302/303 are re-sent as GET
@@ -12,20 +12,44 @@
 #
 
 
+import math
 import sys
 
+try:
+    import numpy  # vectorized statistics.  Only used on systems that have it installed.
+except ImportError:
+    numpy = None
+
+
+
+HISTOGRAM_PRECISION = 0.01  # relative error of values reported by Histogram (1%)
+HISTOGRAM_LOWEST = 0.000001  # values below this (1 microsec for latencies) share the first bucket
+
 
 class Stats:
         
     def __init__(self, sequence):
         # sequence of numbers
-        # convert all items to floats for numerical processing        
-        self.sequence = [float(item) for item in sequence]
+        # convert all items to floats for numerical processing.  with NumPy they go into a float array
+        if numpy is not None:
+            self.sequence = numpy.array(sequence, dtype=float)  # always a copy, we sort it in place
+        else:
+            self.sequence = [float(item) for item in sequence]
+        self.is_sorted = False
+    
+    
+    def sort(self):
+        # sort once, however many percentiles are asked for
+        if not self.is_sorted:
+            self.sequence.sort()
+            self.is_sorted = True
     
     
     def sum(self):
         if len(self.sequence) < 1: 
             return None
+        elif numpy is not None:
+            return float(self.sequence.sum())
         else:
             return sum(self.sequence)
     
@@ -37,6 +61,8 @@ class Stats:
     def min(self):
         if len(self.sequence) < 1: 
             return None
+        elif numpy is not None:
+            return float(self.sequence.min())
         else:
             return min(self.sequence)
     
@@ -44,6 +70,8 @@ class Stats:
     def max(self):
         if len(self.sequence) < 1: 
             return None
+        elif numpy is not None:
+            return float(self.sequence.max())
         else:
             return max(self.sequence)
     
@@ -52,15 +80,15 @@ class Stats:
         if len(self.sequence) < 1: 
             return None
         else: 
-            return sum(self.sequence) / len(self.sequence)    
+            return self.sum() / len(self.sequence)    
     
     
     def median(self):
         if len(self.sequence) < 1: 
             return None
         else:
-            seq.sort()
-            return self.sequence[len(self.sequence) // 2]
+            self.sort()
+            return float(self.sequence[len(self.sequence) // 2])
             
     
     def stdev(self):
@@ -68,6 +96,8 @@ class Stats:
             return None
         if len(self.sequence) == 1: 
             return 0
+        elif numpy is not None:
+            return float(self.sequence.std(ddof=1))
         else:
             avg = self.avg()
             sdsq = sum([(i - avg) ** 2 for i in self.sequence])
@@ -83,6 +113,171 @@ class Stats:
             value = None
         else:
             element_idx = int(len(self.sequence) * (percentile / 100.0))
-            self.sequence.sort()
-            value = self.sequence[element_idx]
+            self.sort()
+            value = float(self.sequence[element_idx])
         return value
+
+
+
+
+class Histogram:
+    # log-bucketed histogram with the same interface as Stats, for large data sets.
+    # bucket i holds values from lowest * (1 + precision) ** i up to the next bucket, so every value
+    # it reports is within precision of a recorded one.  recording is O(1), percentiles walk the
+    # (few hundred) buckets, and histograms with the same layout merge without losing anything
+    def __init__(self, sequence=None, precision=HISTOGRAM_PRECISION, lowest=HISTOGRAM_LOWEST):
+        self.precision = precision
+        self.lowest = lowest
+        self.log_base = math.log(1 + precision)
+        self.counts = {}  # bucket index -> count
+        self.total_count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.min_value = None
+        self.max_value = None
+        if sequence:
+            for value in sequence:
+                self.record(float(value))
+    
+    
+    def bucket(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self.log_base) + 1
+    
+    
+    def bucket_value(self, idx):
+        # geometric middle of the bucket.  the first bucket holds everything from 0 up to lowest
+        if idx == 0:
+            return 0.0
+        return self.lowest * (1 + self.precision) ** (idx - 0.5)
+    
+    
+    def record(self, value, count=1):
+        idx = self.bucket(value)
+        self.counts[idx] = self.counts.get(idx, 0) + count
+        self.total_count += count
+        self.total += value * count
+        self.total_squares += value * value * count
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+    
+    
+    def record_array(self, values):
+        # record a NumPy array of values at once
+        if not len(values):
+            return
+        values = numpy.asarray(values, dtype=float)
+        idxs = numpy.zeros(len(values), dtype=numpy.intp)
+        above = values > self.lowest
+        idxs[above] = (numpy.log(values[above] / self.lowest) / self.log_base).astype(numpy.intp) + 1
+        bucket_counts = numpy.bincount(idxs)
+        for idx in numpy.flatnonzero(bucket_counts):
+            idx = int(idx)
+            self.counts[idx] = self.counts.get(idx, 0) + int(bucket_counts[idx])
+        self.total_count += len(values)
+        self.total += float(values.sum())
+        self.total_squares += float(numpy.dot(values, values))
+        low, high = float(values.min()), float(values.max())
+        if self.min_value is None or low < self.min_value:
+            self.min_value = low
+        if self.max_value is None or high > self.max_value:
+            self.max_value = high
+    
+    
+    def merge(self, other):
+        if other.precision != self.precision or other.lowest != self.lowest:
+            raise ValueError('can not merge histograms with different bucket layouts')
+        counts = self.counts
+        get = counts.get
+        for idx, count in other.counts.iteritems():
+            counts[idx] = get(idx, 0) + count
+        self.total_count += other.total_count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        if other.min_value is not None and (self.min_value is None or other.min_value < self.min_value):
+            self.min_value = other.min_value
+        if other.max_value is not None and (self.max_value is None or other.max_value > self.max_value):
+            self.max_value = other.max_value
+    
+    
+    def copy(self):
+        # copying the bucket dict is a single operation, so this is safe while another thread records
+        other = Histogram(precision=self.precision, lowest=self.lowest)
+        other.counts = dict(self.counts)
+        other.total_count = self.total_count
+        other.total = self.total
+        other.total_squares = self.total_squares
+        other.min_value = self.min_value
+        other.max_value = self.max_value
+        return other
+    
+    
+    def difference(self, earlier):
+        # histogram of the values recorded since earlier, an older copy of this one.
+        # the exact min and max of those values are gone, so they are taken from the outer buckets
+        if earlier.precision != self.precision or earlier.lowest != self.lowest:
+            raise ValueError('can not subtract histograms with different bucket layouts')
+        other = Histogram(precision=self.precision, lowest=self.lowest)
+        for idx, count in self.counts.iteritems():
+            count -= earlier.counts.get(idx, 0)
+            if count > 0:
+                other.counts[idx] = count
+        other.total_count = self.total_count - earlier.total_count
+        other.total = self.total - earlier.total
+        other.total_squares = self.total_squares - earlier.total_squares
+        if other.counts:
+            other.min_value = max(self.bucket_value(min(other.counts)), self.min_value)
+            other.max_value = min(self.bucket_value(max(other.counts)), self.max_value)
+        return other
+    
+    
+    def sum(self):
+        if self.total_count < 1: 
+            return None
+        return self.total
+    
+    
+    def count(self):
+        return self.total_count
+    
+    
+    def min(self):
+        return self.min_value
+    
+    
+    def max(self):
+        return self.max_value
+    
+    
+    def avg(self):
+        if self.total_count < 1: 
+            return None
+        return self.total / self.total_count
+    
+    
+    def stdev(self):
+        if self.total_count < 1: 
+            return None
+        if self.total_count == 1: 
+            return 0
+        avg = self.avg()
+        sdsq = max(self.total_squares - self.total_count * avg * avg, 0.0)  # rounding can take it just below 0
+        return (sdsq / (self.total_count - 1)) ** .5
+    
+    
+    def percentile(self, percentile):
+        # same element Stats.percentile() picks, reported with the precision of its bucket
+        if self.total_count < 1: 
+            return None
+        elif (percentile >= 100):
+            print 'ERROR: percentile must be < 100.  you supplied: %s\n' % percentile
+            return None
+        element_idx = int(self.total_count * (percentile / 100.0))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen > element_idx:
+                return min(max(self.bucket_value(idx), self.min_value), self.max_value)
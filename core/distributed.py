@@ -0,0 +1,268 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Distributed tests.  A node started with -p/--port listens for XML-RPC
+#  commands (NodeServer).  A controller (run.py -c host:port,host:port) pushes
+#  the test cases and each node's share of the agents to every node, starts
+#  them all at the same moment, and collects their rollups, agent stats and
+#  error logs when they finish.  Rollups hold mergeable histograms, so the
+#  controller builds one results.html for the whole test from them.
+
+
+import glob
+import os
+import pickle
+import time
+import xmlrpclib
+from threading import Thread
+import config
+import resultstore
+import results
+import xmlparse
+from engine import ErrorQueue, LoadManager, snapshot_stats
+
+
+
+START_DELAY = 5  # secs from sending the start command to the synchronized start
+POLL_INTERVAL = 1  # secs between status checks of the running nodes
+
+
+
+class NodeRunner(Thread):
+    # runs one test on this node, starting at an agreed time (in this node's clock)
+    def __init__(self, cases, workload, start_time, output_dir=None, test_name=None):
+        Thread.__init__(self)
+        self.cases = cases
+        self.workload = workload
+        self.start_time = start_time
+        self.output_dir = output_dir
+        self.test_name = test_name
+        self.status = 'waiting'
+
+    def run(self):
+        try:
+            delay = self.start_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.status = 'running'
+            runtime_stats = {}
+            error_queue = ErrorQueue()
+            lm = LoadManager(self.workload['agents'], self.workload['interval'] / 1000.0, self.workload['rampup'],
+                False, runtime_stats, error_queue, self.output_dir, self.test_name)
+            for req in self.cases:
+                lm.add_req(req)
+            lm.setDaemon(True)
+            lm.start()
+            time.sleep(self.workload['duration'])
+            lm.stop()
+            if config.GENERATE_RESULTS:  # this node's own report
+                while lm.results_gen.isAlive():
+                    time.sleep(0.1)
+            else:
+                lm.store_for_post_processing(lm.output_dir, snapshot_stats(runtime_stats), lm.workload)
+            self.output_dir = lm.output_dir
+            self.status = 'done'
+        except Exception, e:
+            self.status = 'failed: %s' % e
+
+
+
+
+class NodeServer:
+    # XML-RPC commands of a node, called by a Controller
+    def __init__(self, output_dir=None, test_name=None):
+        self.output_dir = output_dir
+        self.test_name = test_name
+        self.cases = None
+        self.workload = None
+        self.runner = None
+
+    def clock(self):
+        # this node's time, so the controller can work out the clock offset
+        return time.time()
+
+    def prepare(self, tc_xml, workload):
+        # tc_xml is the test case xml (an xmlrpclib.Binary), workload has agents, rampup, interval (millisecs) and duration
+        if self.runner is not None and self.runner.isAlive():
+            raise RuntimeError('a test is already running on this node')
+        if not config.ROLLUP_INTERVAL:
+            raise RuntimeError('rollups are disabled on this node (ROLLUP_INTERVAL = 0).  start it with run.py -p, which turns them on')
+        self.cases = xmlparse.load_xml_string_cases(tc_xml.data)
+        self.workload = workload
+        self.runner = None
+        return True
+
+    def start_at(self, start_time):
+        if self.cases is None:
+            raise RuntimeError('no test prepared on this node')
+        self.runner = NodeRunner(self.cases, self.workload, start_time, self.output_dir, self.test_name)
+        self.runner.setDaemon(True)
+        self.runner.start()
+        self.cases = None  # each prepared test runs once
+        return True
+
+    def status(self):
+        # 'idle', 'waiting', 'running', 'done' or 'failed: <error>'
+        if self.runner is None:
+            return 'idle'
+        return self.runner.status
+
+    def results(self):
+        # the files of the finished test the controller needs, as xmlrpclib.Binary
+        if self.status() != 'done':
+            raise RuntimeError('no finished test on this node')
+        dir = self.runner.output_dir
+        files = {}
+        for name in (resultstore.ROLLUP_FILE, 'agent_detail.dat', 'workload_detail.dat'):
+            files[name] = read_binary(os.path.join(dir, name))
+        errors = {}
+        for filename in glob.glob(dir + r'/*errors.log') + glob.glob(dir + r'/*error_counts.csv'):
+            errors[os.path.basename(filename)] = read_binary(filename)
+        files['errors'] = errors
+        return files
+
+
+
+
+class Controller:
+    # runs a test on several nodes and merges their results into one report
+    def __init__(self, nodes, num_agents, rampup, interval, duration, tc_xml_filename, output_dir=None, test_name=None):
+        self.nodes = nodes  # 'host:port' of each node
+        self.num_agents = num_agents
+        self.rampup = rampup
+        self.interval = interval  # millisecs
+        self.duration = duration
+        self.tc_xml_filename = tc_xml_filename
+        self.test_name = test_name
+
+        if output_dir and test_name:
+            self.output_dir = time.strftime(output_dir + '/' + test_name + '_' + 'results_%Y.%m.%d_%H.%M.%S', time.localtime())
+        elif output_dir:
+            self.output_dir = time.strftime(output_dir + '/' + 'results_%Y.%m.%d_%H.%M.%S', time.localtime())
+        elif test_name:
+            self.output_dir = time.strftime('results/' + test_name + '_' + 'results_%Y.%m.%d_%H.%M.%S', time.localtime())
+        else:
+            self.output_dir = time.strftime('results/results_%Y.%m.%d_%H.%M.%S', time.localtime())
+
+    def run(self):
+        proxies = [xmlrpclib.ServerProxy('http://%s/' % node) for node in self.nodes]
+        tc_xml = read_binary(self.tc_xml_filename)
+
+        # every node gets its share of the agents and the same test cases
+        for node_num, proxy in enumerate(proxies):
+            agents = self.num_agents // len(proxies)
+            if node_num < self.num_agents % len(proxies):
+                agents += 1
+            workload = {'agents': agents, 'rampup': self.rampup, 'interval': self.interval, 'duration': self.duration}
+            proxy.prepare(tc_xml, workload)
+
+        # start them together.  each node is told the start time in its own clock
+        offsets = [clock_offset(proxy) for proxy in proxies]
+        start_time = time.time() + START_DELAY
+        for proxy, offset in zip(proxies, offsets):
+            proxy.start_at(start_time + offset)
+        print 'Test starts on %d nodes in %d secs\n' % (len(proxies), START_DELAY)
+
+        time.sleep(max(start_time + self.duration - time.time(), 0))
+        pending = range(len(proxies))
+        while pending:
+            for node_num in list(pending):
+                status = proxies[node_num].status()
+                if status == 'done':
+                    pending.remove(node_num)
+                elif status.startswith('failed'):
+                    raise RuntimeError('node %s %s' % (self.nodes[node_num], status))
+            if pending:
+                time.sleep(POLL_INTERVAL)
+        print 'All nodes finished.  Collecting results...'
+
+        try:
+            os.makedirs(self.output_dir, 0755)
+        except OSError:
+            self.output_dir = self.output_dir + time.strftime('/results_%Y.%m.%d_%H.%M.%S', time.localtime())
+            os.makedirs(self.output_dir, 0755)
+        self.merge_results([proxy.results() for proxy in proxies], offsets)
+        results.generate_results(self.output_dir, self.test_name)
+
+    def merge_results(self, node_files, offsets):
+        # one set of result files, as if a single load manager had run every agent
+        rollups = open(os.path.join(self.output_dir, resultstore.ROLLUP_FILE), 'wb')
+        runtime_stats = {}
+        workload = None
+        for node_num, (files, offset) in enumerate(zip(node_files, offsets)):
+            # rollups are joined into one file.  the reader merges intervals and urls that appear more than once.
+            # the intervals are moved by the node's clock offset (to whole intervals), so they line up across nodes
+            node_path = os.path.join(self.output_dir, 'node_%d_%s' % (node_num + 1, resultstore.ROLLUP_FILE))
+            write_binary(node_path, files[resultstore.ROLLUP_FILE])
+            shift = 0
+            for record in resultstore.read_rollup_records(node_path):
+                if record[0] == 'interval':
+                    shift = int(round(offset / record[1])) * record[1]
+                elif record[0] == 'rollup':
+                    groups = {}
+                    for group, state in record[2].iteritems():
+                        groups[group] = state[:3] + (state[3] - shift, state[4] - shift) + state[5:]
+                    record = ('rollup', record[1] - shift, groups)
+                pickle.dump(record, rollups, pickle.HIGHEST_PROTOCOL)
+            os.remove(node_path)
+
+            # agents are numbered across all nodes, node 1 first
+            node_stats = pickle.loads(files['agent_detail.dat'].data)
+            first_id = len(runtime_stats)
+            for id in sorted(node_stats):
+                runtime_stats[first_id + id] = node_stats[id]
+
+            node_workload = pickle.loads(files['workload_detail.dat'].data)
+            if workload is None:
+                workload = node_workload
+                workload['nodes'] = len(node_files)
+            else:
+                workload['num_agents'] += node_workload['num_agents']
+                workload['start_epoch'] = min(workload['start_epoch'], node_workload['start_epoch'])
+                for key in ('dispatched', 'dropped_dispatches', 'late_dispatches', 'results_dropped'):
+                    if key in node_workload:
+                        workload[key] = workload.get(key, 0) + node_workload[key]
+
+            for filename, contents in files['errors'].iteritems():
+                write_binary(os.path.join(self.output_dir, 'node_%d_%s' % (node_num + 1, filename)), contents)
+        rollups.close()
+
+        fh = open(self.output_dir + '/agent_detail.dat', 'w')
+        pickle.dump(runtime_stats, fh)
+        fh.close()
+        fh = open(self.output_dir + '/workload_detail.dat', 'w')
+        pickle.dump(workload, fh)
+        fh.close()
+
+
+
+
+def clock_offset(proxy):
+    # how far the node's clock is ahead of ours, measured around one round trip
+    sent = time.time()
+    node_time = proxy.clock()
+    received = time.time()
+    return node_time - (sent + received) / 2.0
+
+
+def read_binary(path):
+    fh = open(path, 'rb')
+    contents = xmlrpclib.Binary(fh.read())
+    fh.close()
+    return contents
+
+
+def write_binary(path, contents):
+    fh = open(path, 'wb')
+    fh.write(contents.data)
+    fh.close()
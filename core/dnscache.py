@@ -0,0 +1,111 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Name resolution shared by all agents of a process.  Without it every new
+#  connection asks the system resolver again, and hundreds of agents doing that
+#  add latency noise or get throttled into errors that look like server
+#  failures.  Lookups are cached for DNS_CACHE_TTL secs (getaddrinfo doesn't
+#  tell us the record's own TTL).  Hosts in DNS_PINS are never resolved.  The
+#  addresses of a host are handed out round-robin, so connections spread over
+#  all of them.
+
+
+import socket
+import time
+from threading import Event, Lock
+import config
+
+
+
+DNS_CACHE_TTL = config.DNS_CACHE_TTL  # secs.  0 resolves every connection
+DNS_PINS = config.DNS_PINS  # host -> list of IP addresses
+
+
+
+class DNSCache:
+    def __init__(self, ttl=DNS_CACHE_TTL, pins=None):
+        self.ttl = ttl
+        self.pins = pins or {}
+        self.entries = {}  # (host, port) -> (expire time, addresses)
+        self.pending = {}  # (host, port) -> Event, set when the lookup in progress is done
+        self.turns = {}  # (host, port) -> round-robin counter
+        self.lock = Lock()
+
+
+    def getaddrinfo(self, host, port):
+        # socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM), from the pins or the cache when we can.
+        # returns (addresses, is_hit).  when several agents miss at once, one looks the host up and the others wait for it
+        key = (host, port)
+        if host in self.pins:
+            return (self.rotate(key, pinned_addresses(self.pins[host], port)), True)
+        if not self.ttl:
+            return (socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM), False)
+        while True:
+            self.lock.acquire()
+            try:
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] > time.time():
+                    return (self.rotate(key, entry[1]), True)
+                done = self.pending.get(key)
+                if done is None:
+                    done = self.pending[key] = Event()
+                    break
+            finally:
+                self.lock.release()
+            done.wait()  # and look again.  if that lookup failed, we try it ourselves
+        try:
+            addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            self.lock.acquire()
+            try:
+                self.entries[key] = (time.time() + self.ttl, addresses)
+            finally:
+                self.lock.release()
+        finally:
+            self.lock.acquire()
+            try:
+                del self.pending[key]
+            finally:
+                self.lock.release()
+            done.set()
+        return (self.rotate(key, addresses), False)
+
+
+    def rotate(self, key, addresses):
+        # the addresses, starting with the next one in turn
+        if len(addresses) < 2:
+            return addresses
+        self.lock.acquire()
+        try:
+            turn = self.turns.get(key, 0)
+            self.turns[key] = turn + 1
+        finally:
+            self.lock.release()
+        turn %= len(addresses)
+        return addresses[turn:] + addresses[:turn]
+
+
+
+
+def pinned_addresses(ips, port):
+    # getaddrinfo results for a list of IP addresses
+    addresses = []
+    for ip in ips:
+        if ':' in ip:
+            addresses.append((socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (ip, port, 0, 0)))
+        else:
+            addresses.append((socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (ip, port)))
+    return addresses
+
+
+
+cache = DNSCache(pins=DNS_PINS)  # shared by the agents of this process
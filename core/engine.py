@@ -12,8 +12,9 @@
 #
  
 
+import collections
 import cookielib
-import copy
+import gzip
 import httplib
 import os
 import pickle
@@ -27,7 +28,11 @@ import urllib2
 import urlparse
 from threading import Thread
 import config
+import connpool
 import results
+import timing
+import tlssession
+from corestats import Histogram
 
 
 
@@ -38,6 +43,36 @@ HTTP_DEBUG = config.HTTP_DEBUG  # default is False
 SHUFFLE_TESTCASES = config.SHUFFLE_TESTCASES  # default is False
 WAITFOR_AGENT_FINISH = config.WAITFOR_AGENT_FINISH  # wait for last requests to complete before stopping. default is True
 SOCKET_TIMEOUT = config.SOCKET_TIMEOUT  # global for all socket operations
+KEEPALIVE = config.KEEPALIVE  # reuse persistent connections per agent. default is False
+KEEPALIVE_MAX_IDLE = config.KEEPALIVE_MAX_IDLE  # secs before an idle pooled connection is discarded
+ENGINE = config.ENGINE  # 'threads' (one thread per agent) or 'events' (all agents on one event loop)
+WORKER_PROCESSES = config.WORKER_PROCESSES  # shard agents across this many processes. default is 1 (no sharding)
+ARRIVAL_RATE = config.ARRIVAL_RATE  # req/sec for the open workload model. default is 0 (closed model)
+VERIFY_STREAM_LIMIT = config.VERIFY_STREAM_LIMIT  # bytes. default is 0 (read and verify whole bodies)
+VERIFY_CHUNK_SIZE = 8192  # bytes read at a time when verifying a body as it arrives
+DISCARD_BODIES = config.DISCARD_BODIES  # default is False
+DISCARD_CHUNK_SIZE = 65536  # bytes read at a time when discarding a body
+REGEX_CHARS = '.^$*+?{}[]\\|()'  # a verification without any of these is a plain substring
+RESULTS_QUEUE_SIZE = config.RESULTS_QUEUE_SIZE  # 0 is unbounded
+RESULTS_QUEUE_FULL = config.RESULTS_QUEUE_FULL  # 'block' or 'drop'
+RESULTS_FLUSH_INTERVAL = config.RESULTS_FLUSH_INTERVAL  # secs
+RESULTS_FORMAT = config.RESULTS_FORMAT  # 'csv', 'binary' or 'both'
+ROLLUP_INTERVAL = config.ROLLUP_INTERVAL  # secs.  0 is no rollups
+RAW_RESULTS = config.RAW_RESULTS  # default is True
+RESULTS_BATCH_SIZE = 1000  # max rows the ResultWriter takes off the queue at a time
+RESULTS_BUFFER_SIZE = 1048576  # bytes.  write buffer of agent_stats.csv
+ERROR_QUEUE_SIZE = 1000  # recent errors kept for live display.  the oldest are dropped once it is full
+ERROR_BUFFER_SIZE = 65536  # bytes.  write buffer of each agent's error log
+ERROR_FLUSH_INTERVAL = 1  # secs.  how often an agent's error log and error counts are written out
+TRACE_SAMPLE = config.TRACE_SAMPLE  # default is 1 (every request)
+TRACE_ERRORS_ONLY = config.TRACE_ERRORS_ONLY  # default is False
+TRACE_SLOWER_THAN = config.TRACE_SLOWER_THAN  # secs.  default is 0 (any response time)
+TRACE_BODY_LIMIT = config.TRACE_BODY_LIMIT  # bytes.  default is 0 (whole bodies)
+TRACE_COMPRESS = config.TRACE_COMPRESS  # default is False
+TRACE_QUEUE_SIZE = 10000  # messages waiting for the TraceWriter.  more are dropped (and counted)
+TRACE_BUFFER_SIZE = 1048576  # bytes.  write buffer of each message log
+TRACE_FLUSH_INTERVAL = 1  # secs.  how often the message logs are flushed to disk
+LIVE_PRECISION = 0.05  # relative error of the live percentiles.  coarse buckets keep monitor refreshes cheap
 
         
         
@@ -53,7 +88,7 @@ class LoadManager(Thread):
         self.rampup = rampup
         self.log_msgs = log_msgs
         self.runtime_stats = runtime_stats
-        self.error_queue = error_queue  # list used like a queue
+        self.error_queue = error_queue  # ErrorQueue of recent errors, for display
         self.test_name = test_name
 
         if output_dir and test_name:
@@ -67,17 +102,18 @@ class LoadManager(Thread):
         
         # initialize/reset stats
         for i in range(self.num_agents): 
-            self.runtime_stats[i] = StatCollection(0, '', 0, 0, 0, 0, 0, 0)
+            self.runtime_stats[i] = StatCollection()
             
         self.workload = {
             'num_agents': num_agents, 
             'interval': interval * 1000,  # convert to millisecs   
             'rampup': rampup, 
-            'start_epoch': time.mktime(time.localtime())
+            'start_epoch': time.mktime(time.localtime()),
+            'arrival_rate': ARRIVAL_RATE
         }  
         
-        self.results_queue = Queue.Queue()  # result stats get queued up by agent threads
-        self.agent_refs = []
+        self.results_queue = ResultsQueue(RESULTS_QUEUE_SIZE)  # result stats get queued up by agent threads
+        self.agents = None  # AgentGroup, or sharding.ShardPool when agents run in worker processes
         self.msg_queue = []  # list of Request objects
         
     
@@ -99,14 +135,18 @@ class LoadManager(Thread):
         self.results_writer.setDaemon(True)
         self.results_writer.start()
         
+        if WORKER_PROCESSES > 1 and not sys.platform.startswith('win'):
+            import sharding  # imported here because sharding builds on this module
+            self.agents = sharding.ShardPool(WORKER_PROCESSES, self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue, ARRIVAL_RATE)
+        else:
+            self.agents = AgentGroup(self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue, ARRIVAL_RATE)
+        
         for i in range(self.num_agents):
             spacing = float(self.rampup) / float(self.num_agents)
             if i > 0:  # first agent starts right away
                 time.sleep(spacing)
             if self.running:  # in case stop() was called before all agents are started
-                agent = LoadAgent(i, self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue)
-                agent.start()
-                self.agent_refs.append(agent)
+                self.agents.add_agent(i)
                 agent_started_line = 'Started agent ' + str(i + 1) 
                 if sys.platform.startswith('win'):
                     sys.stdout.write(chr(0x08) * len(agent_started_line))  # move cursor back so we update the same line again
@@ -118,29 +158,35 @@ class LoadManager(Thread):
                     sys.stdout.write(agent_started_line + '\n')
         if sys.platform.startswith('win'):
             sys.stdout.write('\n')
+        if self.running:
+            self.agents.start_schedule()
         print '\nAll agents running...\n\n'
         self.agents_started = True
         
     
     def stop(self):
         self.running = False
-        for agent in self.agent_refs:
-            agent.stop()
+        if not self.agents:  # stopped before run() got to start any agents, or it failed on the way
+            return
+        self.agents.stop()
         
-        if WAITFOR_AGENT_FINISH:
-            keep_running = True
-            while keep_running:
-                keep_running = False
-                for agent in self.agent_refs:
-                    if agent.isAlive():
-                        keep_running = True
-                        time.sleep(0.1)
+        if ARRIVAL_RATE:
+            dispatched, dropped, late = self.agents.dispatch_counts()
+            self.workload['dispatched'] = dispatched
+            self.workload['dropped_dispatches'] = dropped
+            self.workload['late_dispatches'] = late
+            if dropped or late:
+                print 'WARNING: %d dispatches dropped because all agents were busy, %d sent late\n' % (dropped, late)
 
         self.results_writer.stop()
         
+        self.workload['results_dropped'] = self.results_queue.dropped
+        if self.results_queue.dropped:
+            print 'WARNING: %d results dropped because the results queue was full\n' % self.results_queue.dropped
+        
         if GENERATE_RESULTS:
             # pickle dictionaries to files for results post-processing        
-            self.store_for_post_processing(self.output_dir, self.runtime_stats, self.workload)  
+            self.store_for_post_processing(self.output_dir, snapshot_stats(self.runtime_stats), self.workload)  
             
             # auto-generate results from a new thread when the test is stopped
             self.results_gen = results.ResultsGenerator(self.output_dir, self.test_name)
@@ -149,6 +195,7 @@ class LoadManager(Thread):
 
 
     def add_req(self, req):
+        req.freeze()  # shared by all agents from here on
         self.msg_queue.append(req)
         
     
@@ -163,10 +210,110 @@ class LoadManager(Thread):
 
 
 
-class LoadAgent(Thread):  # each Agent/VU runs in its own thread
-    def __init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue):
-        Thread.__init__(self)
+class AgentGroup:
+    # the agents running in this process: one thread each, or all of them on one event loop.
+    # with an arrival rate, agents don't pace themselves but take requests from a scheduler (open model)
+    def __init__(self, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, arrival_rate=0):
+        self.interval = interval
+        self.log_msgs = log_msgs
+        self.output_dir = output_dir
+        self.runtime_stats = runtime_stats
+        self.error_queue = error_queue
+        self.msg_queue = msg_queue
+        self.results_queue = results_queue
+        self.agent_refs = []
+        
+        self.trace_writer = None
+        if log_msgs and TRACE_SAMPLE > 0:
+            self.trace_writer = TraceWriter(output_dir)
+            self.trace_writer.setDaemon(True)
+            self.trace_writer.start()
         
+        self.schedule = None
+        self.scheduler = None
+        if arrival_rate > 0:
+            import scheduler  # imported here because scheduler builds on this module
+            self.schedule = scheduler.ArrivalSchedule(arrival_rate, msg_queue)
+        
+        self.event_loop = None
+        if ENGINE == 'events':
+            import eventengine  # imported here because eventengine builds on this module
+            self.event_loop = eventengine.EventLoop(self.schedule)
+            self.event_loop.setDaemon(True)
+            self.event_loop.start()
+            self.agent_refs.append(self.event_loop)  # stopped and waited for just like an agent thread
+        elif self.schedule:
+            self.idle_agents = Queue.Queue()
+            self.scheduler = scheduler.ArrivalScheduler(self.schedule, self.dispatch)
+            self.scheduler.setDaemon(True)
+            self.scheduler.start()
+            
+            
+    def add_agent(self, id):
+        if self.event_loop:
+            import eventengine
+            self.event_loop.add_user(eventengine.VirtualUser(self.event_loop, id, self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue, self.trace_writer))
+        elif self.scheduler:
+            import scheduler
+            agent = scheduler.DispatchedAgent(id, self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue, self.idle_agents, self.trace_writer)
+            agent.start()
+            self.agent_refs.append(agent)
+        else:
+            agent = LoadAgent(id, self.interval, self.log_msgs, self.output_dir, self.runtime_stats, self.error_queue, self.msg_queue, self.results_queue, self.trace_writer)
+            agent.start()
+            self.agent_refs.append(agent)
+            
+            
+    def dispatch(self, req, intended_time):
+        # called by the scheduler thread.  hand the request to a free agent, if there is one
+        try:
+            agent = self.idle_agents.get(False)
+        except Queue.Empty:
+            return False
+        agent.assign(req, intended_time)
+        return True
+        
+        
+    def start_schedule(self):
+        # the open model's arrivals begin once all agents are running
+        if self.schedule:
+            self.schedule.start()
+
+
+    def dispatch_counts(self):
+        # (dispatched, dropped, late) for the open model
+        if self.schedule:
+            return self.schedule.counts()
+        return (0, 0, 0)
+            
+            
+    def stop(self):
+        if self.scheduler:
+            self.scheduler.stop()
+        for agent in self.agent_refs:
+            agent.stop()
+        
+        if WAITFOR_AGENT_FINISH:
+            keep_running = True
+            while keep_running:
+                keep_running = False
+                for agent in self.agent_refs:
+                    if agent.isAlive():
+                        keep_running = True
+                        time.sleep(0.1)
+        
+        if self.trace_writer:
+            self.trace_writer.stop()
+            if self.trace_writer.dropped:
+                sys.stderr.write('WARNING: %d message logs dropped because the trace queue was full\n' % self.trace_writer.dropped)
+        
+        
+        
+
+class AgentBase:
+    # per-agent counters, result recording and logging.
+    # shared by threaded agents (LoadAgent) and event loop virtual users (eventengine.VirtualUser)
+    def __init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, results_queue, trace_writer=None):
         self.running = True
         self.id = id
         self.interval = interval
@@ -174,99 +321,254 @@ class LoadAgent(Thread):  # each Agent/VU runs in its own thread
         self.output_dir = output_dir
             
         self.runtime_stats = runtime_stats  # shared stats dictionary
-        self.error_queue = error_queue  # shared error list
+        self.error_queue = error_queue  # shared ErrorQueue
+        self.error_log = None  # agent_N_errors.log, opened on the first error
+        self.error_counts = {}  # (status, reason, url) -> [count, first time, last time]
+        self.errors_flushed = time.time()
+        self.results_queue = results_queue  # shared results queue
+        
+        # our entry in the shared stats dictionary.  updated in place after each request
+        self.stats = StatCollection()
+        self.runtime_stats[id] = self.stats
+        
+        self.agent_start_time = None
+        self.count = 0
+        self.error_count = 0
+        self.total_latency = 0
+        self.total_connect_latency = 0
+        self.total_bytes = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.dns_hits = 0  # host name lookups answered by the dnscache
+        self.dns_misses = 0
+        self.tls_full = 0  # TLS handshakes, full or resuming a session
+        self.tls_resumed = 0
+        self.tls_unknown = 0  # handshakes we can't tell
+        
+        # requests are timed with a monotonic clock (see core/timing.py).  results are logged with wall clock end times
+        self.default_timer = timing.timer
+        self.phases = timing.Phases()  # connection setup times of the request in flight
+        self.tls_sessions = tlssession.SessionCache()  # our TLS sessions, resumed when we reconnect
+            
+        self.trace_writer = trace_writer  # shared TraceWriter, when messages are logged
+        self.trace_count = 0  # requests that passed the trace filters, for TRACE_SAMPLE
+        self.trace_logging = False
+        if self.log_msgs and TRACE_SAMPLE > 0:  # 0 logs nothing
+            self.enable_trace_logging()
+            
+            
+    def record(self, req, resp, content, req_start_time, req_end_time, connect_end_time, intended_start=None, resp_bytes=None):
+        # check a completed request for errors, update shared stats and queue the result.  returns the latency.
+        # intended_start is when the pacing schedule wanted the request sent (same clock as default_timer).
+        # the corrected latency is measured from there, so time spent waiting behind a stall is not lost.
+        # resp_bytes is the body size when the body was discarded instead of kept in content.
+        # the connection setup times of the request are in self.phases
+        
+        # get times for logging and error display
+        end_epoch = time.time() - (self.default_timer() - req_end_time)
+        tmp_time = time.localtime()
+        cur_date = time.strftime('%d %b %Y', tmp_time)
+        cur_time = time.strftime('%H:%M:%S', tmp_time)
         
-        # copy message/request queue and all its request objects so we have a unique copy for each agent.
-        # this is really slow when there are a lot (1000+) test cases, so we disable it unless we really need to do this.
-        # it is necessary for cookies and randomization to work correctly.
-        if (SHUFFLE_TESTCASES or COOKIES_ENABLED):
-            self.msg_queue = copy.deepcopy(msg_queue)  
+        # check verifications and status code for errors
+        is_error = self.is_error(req, resp, content)
+    
+        if is_error:                    
+            self.error_count += 1
+            error_string = 'Agent %s:  %s - %d %s,  url: %s' % (self.id + 1, cur_time, resp.code, resp.msg, req.url)
+            self.error_queue.append(error_string)
+            log_tuple = (self.id + 1, cur_date, cur_time, end_epoch, req.url.replace(',', ''), resp.code, resp.msg.replace(',', ''))
+            self.log_error('%s,%s,%s,%s,%s,%s,%s' % log_tuple)  # write as csv
+            self.count_error(resp.code, resp.msg, req.url)
+            
+        if resp_bytes is None:
+            resp_bytes = len(content)
+        latency = (req_end_time - req_start_time)
+        connect_latency = (connect_end_time - req_start_time)
+        if intended_start is not None and intended_start < req_start_time:
+            corrected_latency = (req_end_time - intended_start)
         else:
-            self.msg_queue = msg_queue
+            corrected_latency = latency
         
-        if SHUFFLE_TESTCASES:  # randomize order of testcases per agent
-            random.shuffle(self.msg_queue)
+        self.count += 1
+        self.total_bytes += resp_bytes
+        self.total_latency += latency
+        self.total_connect_latency += connect_latency
+        self.new_connections += self.phases.connections
+        self.dns_hits += self.phases.dns_hits
+        self.dns_misses += self.phases.dns_misses
+        self.tls_full += self.phases.tls_full
+        self.tls_resumed += self.phases.tls_resumed
+        self.tls_unknown += self.phases.tls_unknown
         
-        self.results_queue = results_queue  # shared results queue
+        # update shared stats dictionary
+        self.stats.update(resp.code, resp.msg, latency, self.count, self.error_count, self.total_latency, self.total_connect_latency, self.total_bytes, self.new_connections, self.reused_connections, self.dns_hits, self.dns_misses, self.tls_full, self.tls_resumed, self.tls_unknown)
         
-        self.count = 0
-        self.error_count = 0
+        # put response stats/info on queue for reading by the consumer (ResultWriter) thread
+        q_tuple = (self.id + 1, cur_date, cur_time, end_epoch, req.url.replace(',', ''), resp.code, resp.msg.replace(',', ''), resp_bytes, latency, connect_latency, req.timer_group, corrected_latency) + \
+            self.phases.split(req_start_time, connect_end_time, req_end_time)
+        self.results_queue.add(q_tuple)
         
-        # choose timer to use:
-        if sys.platform.startswith('win'):
-            self.default_timer = time.clock  # time.clock() is more precise on Windows systems
+        return latency
+
+    
+    def is_error(self, req, resp, content):
+        # a failed status code or verification
+        if resp.code >= 400 or resp.code == 0:
+            return True
+        if req.verify_check is None and (req.verify or req.verify_negative):
+            req.compile_verifications()  # Request built without xmlparse
+        if req.verify_check:
+            if not req.verify_check.search(content): 
+                return True
+        if req.verify_negative_check:
+            if req.verify_negative_check.search(content):
+                return True
+        return False
+    
+    
+    def mark_started(self):
+        self.agent_start_time = time.strftime('%H:%M:%S', time.localtime())
+        self.stats.agent_start_time = self.agent_start_time
+    
+    
+    def log_error(self, txt):
+        # the error log stays open and buffered.  it is flushed every ERROR_FLUSH_INTERVAL secs and when the agent finishes
+        try:
+            if self.error_log is None:
+                self.error_log = open('%s/agent_%d_errors.log' % (self.output_dir, self.id + 1), 'a', ERROR_BUFFER_SIZE)
+            self.error_log.write('%s\n' % txt)
+        except IOError, e: 
+            sys.stderr.write('ERROR: Can not write to error log file\n')
+    
+    
+    def count_error(self, status, reason, url):
+        # errors aggregated by (status, reason, url), written to agent_N_error_counts.csv with the error log
+        now = time.time()
+        key = (status, reason, url)
+        counts = self.error_counts.get(key)
+        if counts is None:
+            self.error_counts[key] = [1, now, now]
         else:
-            self.default_timer = time.time  # time.time() is more precise on Linux/Unix and most other platforms 
+            counts[0] += 1
+            counts[2] = now
+        if now - self.errors_flushed >= ERROR_FLUSH_INTERVAL:
+            self.flush_errors()
+    
+    
+    def flush_errors(self):
+        self.errors_flushed = time.time()
+        if not self.error_counts:
+            return
+        try:
+            if self.error_log is not None:
+                self.error_log.flush()
+            fh = open('%s/agent_%d_error_counts.csv' % (self.output_dir, self.id + 1), 'w')
+            for (status, reason, url), (count, first_time, last_time) in self.error_counts.iteritems():
+                fh.write('%d,%s,%s,%d,%.3f,%.3f\n' % (status, reason.replace(',', ''), url.replace(',', ''), count, first_time, last_time))
+            fh.close()
+        except IOError, e: 
+            sys.stderr.write('ERROR: Can not write to error log file\n')
+    
+    
+    def close_error_log(self):
+        self.flush_errors()
+        if self.error_log is not None:
+            self.error_log.close()
+            self.error_log = None
+    
+    
+    def log_http_msgs(self, req, request, resp, content, latency):
+        # the whole exchange is formatted into one message and queued for the TraceWriter.
+        # with TRACE_ERRORS_ONLY or TRACE_SLOWER_THAN only failed or slow requests are logged, then 1 in TRACE_SAMPLE of those
+        if TRACE_ERRORS_ONLY or TRACE_SLOWER_THAN:
+            if not ((TRACE_ERRORS_ONLY and self.is_error(req, resp, content)) or (TRACE_SLOWER_THAN and latency >= TRACE_SLOWER_THAN)):
+                return
+        self.trace_count += 1
+        if (self.trace_count - 1) % TRACE_SAMPLE:
+            return
+        path = urlparse.urlparse(req.url).path
+        if path == '':
+            path = '/'
+        lines = ['\n\n************************* REQUEST *************************\n\n']
+        lines.append('%s %s' % (req.method.upper(), path))
+        for header_tuple in request.header_items():
+            lines.append('%s: %s' % (header_tuple[0], header_tuple[1]))
+        lines.append('\n\n************************* RESPONSE ************************\n\n')
+        lines.append('%s %s' % (resp.code, resp.msg)) 
+        for header in resp.headers:
+            lines.append('%s: %s' % (header, resp.headers[header]))   
+        if TRACE_BODY_LIMIT and len(content) > TRACE_BODY_LIMIT:
+            content = '%s\n\n[%d more bytes not logged]' % (content[:TRACE_BODY_LIMIT], len(content) - TRACE_BODY_LIMIT)
+        lines.append('\n\n%s' % content)
+        self.log_trace('\n'.join(lines))
+     
+     
+    def log_trace(self, txt):
+        self.trace_writer.write(self.id, '%s\n' % txt)
+            
             
+    def enable_trace_logging(self):
+        self.trace_logging = True
+        
+        
+    def disable_trace_logging(self):
+        # the TraceWriter is stopped by the AgentGroup once every agent is done
         self.trace_logging = False
-        if self.log_msgs:
-            self.enable_trace_logging()
+        
+        
+
+class LoadAgent(Thread, AgentBase):  # each Agent/VU runs in its own thread
+    def __init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, trace_writer=None):
+        Thread.__init__(self)
+        AgentBase.__init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, results_queue, trace_writer)
+        
+        # the request objects are shared by all agents.  our cookies and case order live in the context
+        self.context = AgentContext(msg_queue)
+        
+        # persistent connections are owned by the agent and never shared between threads
+        if KEEPALIVE:
+            self.conn_pool = connpool.ConnectionPool(KEEPALIVE_MAX_IDLE, self.phases, self.tls_sessions)
+        else:
+            self.conn_pool = None
         
         
     def run(self):
-        agent_start_time = time.strftime('%H:%M:%S', time.localtime())
-        total_latency = 0
-        total_connect_latency = 0
-        total_bytes = 0
+        self.mark_started()
+        intended_start = None  # when the pacing schedule wants the next request sent
         
         while self.running:
-            self.cookie_jar = cookielib.CookieJar()
-            for req in self.msg_queue:
+            self.context.new_pass()
+            for req in self.context.cases():
                 for repeat in range(req.repeat):
                     if self.running:
-
-                        # send the request message
-                        resp, content, req_start_time, req_end_time, connect_end_time = self.send(req)
-
-                        # get times for logging and error display
-                        tmp_time = time.localtime()
-                        cur_date = time.strftime('%d %b %Y', tmp_time)
-                        cur_time = time.strftime('%H:%M:%S', tmp_time)
                         
-                        # check verifications and status code for errors
-                        is_error = False
-                        if resp.code >= 400 or resp.code == 0:
-                            is_error = True
-                        if not req.verify == '':
-                            if not re.search(req.verify, content, re.DOTALL): 
-                                is_error = True
-                        if not req.verify_negative == '':
-                            if re.search(req.verify_negative, content, re.DOTALL):
-                                is_error = True
-                    
-                        if is_error:                    
-                            self.error_count += 1
-                            error_string = 'Agent %s:  %s - %d %s,  url: %s' % (self.id + 1, cur_time, resp.code, resp.msg, req.url)
-                            self.error_queue.append(error_string)
-                            log_tuple = (self.id + 1, cur_date, cur_time, req_end_time, req.url.replace(',', ''), resp.code, resp.msg.replace(',', ''))
-                            self.log_error('%s,%s,%s,%s,%s,%s,%s' % log_tuple)  # write as csv
-                            
-                        resp_bytes = len(content)
-                        latency = (req_end_time - req_start_time)
-                        connect_latency = (connect_end_time - req_start_time)
+                        # send the request message
+                        resp, content, req_start_time, req_end_time, connect_end_time, resp_bytes = self.send(req)
                         
-                        self.count += 1
-                        total_bytes += resp_bytes
-                        total_latency += latency
-                        total_connect_latency += connect_latency
+                        # without an interval there is no schedule, and record() measures from req_start_time
+                        if self.interval and intended_start is None:
+                            intended_start = req_start_time  # the schedule starts with the first request
                         
-                        # update shared stats dictionary
-                        self.runtime_stats[self.id] = StatCollection(resp.code, resp.msg, latency, self.count, self.error_count, total_latency, total_connect_latency, total_bytes)
-                        self.runtime_stats[self.id].agent_start_time = agent_start_time
+                        self.record(req, resp, content, req_start_time, req_end_time, connect_end_time, intended_start, resp_bytes)
                         
-                        # put response stats/info on queue for reading by the consumer (ResultWriter) thread
-                        q_tuple = (self.id + 1, cur_date, cur_time, req_end_time, req.url.replace(',', ''), resp.code, resp.msg.replace(',', ''), resp_bytes, latency, connect_latency, req.timer_group)
-                        self.results_queue.put(q_tuple)
-                            
-                        expire_time = (self.interval - latency)
-                        if expire_time > 0:
-                            time.sleep(expire_time)  # sleep remainder of interval so we keep even pacing
-                            
-                        time.sleep(req.wait / 1000.0)
+                        if self.interval:
+                            # sleep until the next request is due so we keep even pacing.
+                            # after a slow response this catches up by sending back to back
+                            intended_start += self.interval + (req.wait / 1000.0)
+                            expire_time = intended_start - self.default_timer()
+                            if expire_time > 0:
+                                time.sleep(expire_time)
+                        else:
+                            time.sleep(req.wait / 1000.0)
                     
                     else:  # don't go through entire range if stop has been called
                         break
         
+        if self.conn_pool:
+            self.conn_pool.close()
+        self.close_error_log()
+        
         
     def stop(self):
         self.running = False
@@ -276,23 +578,38 @@ class LoadAgent(Thread):  # each Agent/VU runs in its own thread
             
     def send(self, req):
         # req is our own Request object
-        if HTTP_DEBUG:
-            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookie_jar), urllib2.HTTPHandler(debuglevel=1))
+        # the connection handlers time connection setup into self.phases
+        if self.conn_pool:
+            opener = None
+        elif HTTP_DEBUG:
+            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.context.cookie_jar), connpool.TimedHTTPHandler(self.phases, debuglevel=1), connpool.TimedHTTPSHandler(self.phases, self.tls_sessions))
         elif COOKIES_ENABLED:
-            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookie_jar))
+            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.context.cookie_jar), connpool.TimedHTTPHandler(self.phases), connpool.TimedHTTPSHandler(self.phases, self.tls_sessions))
         else:
-            opener = urllib2.build_opener()
+            opener = urllib2.build_opener(connpool.TimedHTTPHandler(self.phases), connpool.TimedHTTPSHandler(self.phases, self.tls_sessions))
         if req.method.upper() == 'POST':
             request = urllib2.Request(req.url, req.body, req.headers)
         else:  
             request = urllib2.Request(req.url, None, req.headers)  # urllib2 assumes a GET if no data is supplied.  PUT and DELETE are not supported
         
+        resp_bytes = None  # only set when the body is discarded
+        
         # timed message send+receive (TTLB)
+        self.phases.reset()
         req_start_time = self.default_timer()
         try:
-            resp = opener.open(request)  # this sends the HTTP request and returns as soon as it is done connecting and sending
+            if self.conn_pool:
+                resp = self.conn_pool.open(request, self.context.cookie_jar if COOKIES_ENABLED else None)
+            else:
+                resp = opener.open(request)  # this sends the HTTP request and returns as soon as it is done connecting and sending
             connect_end_time = self.default_timer()
-            content = resp.read()
+            if VERIFY_STREAM_LIMIT and (req.verify or req.verify_negative):
+                content = read_until_verified(resp, VerifyStream(req, VERIFY_STREAM_LIMIT))
+            elif DISCARD_BODIES and not (req.verify or req.verify_negative or self.trace_logging):
+                content = ''
+                resp_bytes = discard_body(resp)
+            else:
+                content = resp.read()
             req_end_time = self.default_timer()
         except httplib.HTTPException, e:  # this can happen on an incomplete read, just catch all HTTPException
             connect_end_time = self.default_timer()
@@ -305,7 +622,7 @@ class LoadAgent(Thread):  # each Agent/VU runs in its own thread
             connect_end_time = self.default_timer()
             resp = ErrorResponse()
             resp.code = e.code
-            resp.msg = httplib.responses[e.code]  # constant dict of http error codes/reasons
+            resp.msg = httplib.responses.get(e.code, e.msg)  # constant dict of http error codes/reasons
             resp.headers = dict(e.info())
             content = ''
         except urllib2.URLError, e:  # this also catches socket errors
@@ -316,59 +633,47 @@ class LoadAgent(Thread):  # each Agent/VU runs in its own thread
             resp.headers = {}  # headers are not available in the exception
             content = ''
         req_end_time = self.default_timer()
+        
+        if self.conn_pool:
+            self.reused_connections = self.conn_pool.reused_connections
             
         if self.trace_logging:
             # log request/response messages
-            self.log_http_msgs(req, request, resp, content)
+            self.log_http_msgs(req, request, resp, content, req_end_time - req_start_time)
             
-        return (resp, content, req_start_time, req_end_time, connect_end_time)
+        return (resp, content, req_start_time, req_end_time, connect_end_time, resp_bytes)
 
-    
-    def log_error(self, txt):
-        try:
-            error_log = open('%s/agent_%d_errors.log' % (self.output_dir, self.id + 1), 'a')
-            error_log.write('%s\n' % txt)
-            error_log.flush()
-            error_log.close()
-        except IOError, e: 
-            sys.stderr.write('ERROR: Can not write to error log file\n')
-    
-    
-    def log_http_msgs(self, req, request, resp, content):
-        self.log_trace('\n\n************************* REQUEST *************************\n\n')
-        path = urlparse.urlparse(req.url).path
-        if path == '':
-            path = '/'
-        self.log_trace('%s %s' % (req.method.upper(), path))
-        for header_tuple in request.header_items():
-            self.log_trace('%s: %s' % (header_tuple[0], header_tuple[1]))
-        self.log_trace('\n\n************************* RESPONSE ************************\n\n')
-        self.log_trace('%s %s' % (resp.code, resp.msg)) 
-        for header in resp.headers:
-            self.log_trace('%s: %s' % (header, resp.headers[header]))   
-        self.log_trace('\n\n%s' % content)
-     
-     
-    def log_trace(self, txt):
-        self.trace_log.write('%s\n' % txt)
-        self.trace_log.flush()
-            
-            
-    def enable_trace_logging(self):
-        self.trace_log = open('%s/agent_%d.log' % (self.output_dir, self.id + 1), 'w')
-        self.trace_logging = True
-        
-        
-    def disable_trace_logging(self):
-        self.trace_log.flush()
-        self.trace_log.close()
-        self.trace_logging = False
+
+
+
+class AgentContext:
+    # per-agent state that used to be kept on a private deep copy of the test cases
+    def __init__(self, msg_queue):
+        self.msg_queue = msg_queue
+        self.order = range(len(msg_queue))  # indexes into msg_queue
+        if SHUFFLE_TESTCASES:  # randomize order of testcases per agent
+            random.shuffle(self.order)
+        self.cookie_jar = cookielib.CookieJar()
         
+    def cases(self):
+        # the test cases in this agent's order
+        for idx in self.order:
+            yield self.msg_queue[idx]
             
+    def new_pass(self):
+        # every pass through the test cases starts with no cookies
+        self.cookie_jar = cookielib.CookieJar()
 
 
-class Request():
+
+
+class Request(object):
+    # a test case.  frozen once it is handed to the LoadManager, then shared by all agents without copying
+    __slots__ = ('url', 'method', 'body', 'timer_group', 'repeat', 'wait', 'headers',
+                 'verify', 'verify_negative', 'verify_check', 'verify_negative_check', 'frozen')
+    
     def __init__(self, url='http://localhost/', method='GET', body='', headers=None, timer_group='default_timer', repeat=1, wait=0):
+        object.__setattr__(self, 'frozen', False)
         self.url = url
         self.method = method
         self.body = body
@@ -384,15 +689,21 @@ class Request():
         # verification string or regex
         self.verify = ''
         self.verify_negative = ''
+        self.verify_check = None  # compiled by compile_verifications()
+        self.verify_negative_check = None
         
         # default unless overidden in testcase
         if 'user-agent' not in [header.lower() for header in self.headers]:
             self.add_header('User-Agent', 'Mozilla/4.0 (compatible; Pylot)')
         
         # default unless overidden in testcase
-        # just for logging purposes because urllib2 will always add a "Connection: close" header anyway
+        # just for logging purposes because urllib2 will always add a "Connection: close" header anyway.
+        # with keep-alive enabled, requests go through our own connection pool and the header is sent as-is
         if 'connection' not in [header.lower() for header in self.headers]:
-            self.add_header('Connection', 'close')             
+            if KEEPALIVE:
+                self.add_header('Connection', 'keep-alive')
+            else:
+                self.add_header('Connection', 'close')             
         
         # default unless overidden in testcase
         # httplib adds this header unless we override it.  you can't read this header from a urrllib2 Request 
@@ -400,8 +711,75 @@ class Request():
         if 'accept-encoding' not in [header.lower() for header in self.headers]:
             self.add_header('Accept-Encoding', 'identity') 
             
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError('Request is frozen, it can not be changed once it is shared by the agents')
+        object.__setattr__(self, name, value)
+        
     def add_header(self, header_name, value):
+        if self.frozen:
+            raise AttributeError('Request is frozen, it can not be changed once it is shared by the agents')
         self.headers[header_name] = value
+        
+    def freeze(self):
+        if self.frozen:
+            return
+        self.compile_verifications()
+        self.frozen = True
+        
+    def compile_verifications(self):
+        # build the checks once per test case instead of going through the re cache on every response
+        if self.verify:
+            self.verify_check = Verifier(self.verify)
+        if self.verify_negative:
+            self.verify_negative_check = Verifier(self.verify_negative)
+
+
+
+
+class Verifier():
+    # a compiled verification.  patterns without regex syntax are matched as plain substrings
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.regex = None
+        for char in REGEX_CHARS:
+            if char in pattern:
+                self.regex = re.compile(pattern, re.DOTALL)
+                break
+                
+    def search(self, content):
+        if self.regex:
+            return self.regex.search(content) is not None
+        return self.pattern in content
+
+
+
+
+class VerifyStream():
+    # checks a body chunk by chunk as it is read, to decide when reading can stop:
+    # once the positive verification has matched, or once limit bytes have been read.
+    # negative verifications can only pass on the whole (limited) body, so they never stop it early
+    def __init__(self, req, limit):
+        if req.verify_check is None and (req.verify or req.verify_negative):
+            req.compile_verifications()
+        self.check = req.verify_check
+        self.stop_on_match = req.verify_negative_check is None
+        self.limit = limit
+        self.size = 0
+        self.seen = ''  # substring checks keep the tail of the body, regex checks keep it all (up to limit)
+        self.found = False
+        
+    def feed(self, chunk):
+        # returns True when there is no need to read any further
+        self.size += len(chunk)
+        if self.check and not self.found:
+            text = self.seen + chunk
+            self.found = self.check.search(text)
+            if self.check.regex:
+                self.seen = text
+            else:
+                self.seen = text[len(text) - len(self.check.pattern) + 1:]  # enough to catch a match split over chunks
+        return self.size >= self.limit or (self.found and self.stop_on_match)
 
 
 
@@ -416,8 +794,24 @@ class ErrorResponse():
         
         
         
-class StatCollection():
-    def __init__(self, status, reason, latency, count, error_count, total_latency, total_connect_latency, total_bytes):
+class StatCollection(object):
+    # running totals for one agent.  the agent updates it in place after every request, other threads
+    # read it through snapshot().  there is only one writer, so a version counter is enough to keep
+    # readers from mixing old and new values: it is odd while an update is in progress.
+    # latencies is a histogram of every response time, for live percentiles
+    __slots__ = ('status', 'reason', 'latency', 'count', 'error_count', 'total_latency', 'total_connect_latency',
+                 'total_bytes', 'new_connections', 'reused_connections', 'agent_start_time', 'latencies', 'version',
+                 'dns_hits', 'dns_misses', 'tls_full', 'tls_resumed', 'tls_unknown')
+    
+    def __init__(self, status=0, reason='', latency=0, count=0, error_count=0, total_latency=0, total_connect_latency=0, total_bytes=0, new_connections=0, reused_connections=0, latencies=None, dns_hits=0, dns_misses=0, tls_full=0, tls_resumed=0, tls_unknown=0):
+        self.version = 0
+        self.agent_start_time = None
+        if latencies is None:
+            latencies = Histogram(precision=LIVE_PRECISION)
+        self.latencies = latencies
+        self.set(status, reason, latency, count, error_count, total_latency, total_connect_latency, total_bytes, new_connections, reused_connections, dns_hits, dns_misses, tls_full, tls_resumed, tls_unknown)
+        
+    def set(self, status, reason, latency, count, error_count, total_latency, total_connect_latency, total_bytes, new_connections, reused_connections, dns_hits=0, dns_misses=0, tls_full=0, tls_resumed=0, tls_unknown=0):
         self.status = status
         self.reason = reason
         self.latency = latency
@@ -426,21 +820,183 @@ class StatCollection():
         self.total_latency = total_latency
         self.total_connect_latency = total_connect_latency
         self.total_bytes = total_bytes
+        self.new_connections = new_connections
+        self.reused_connections = reused_connections
+        self.dns_hits = dns_hits
+        self.dns_misses = dns_misses
+        self.tls_full = tls_full
+        self.tls_resumed = tls_resumed
+        self.tls_unknown = tls_unknown
+        
+    def update(self, status, reason, latency, count, error_count, total_latency, total_connect_latency, total_bytes, new_connections, reused_connections, dns_hits=0, dns_misses=0, tls_full=0, tls_resumed=0, tls_unknown=0):
+        self.version += 1
+        self.set(status, reason, latency, count, error_count, total_latency, total_connect_latency, total_bytes, new_connections, reused_connections, dns_hits, dns_misses, tls_full, tls_resumed, tls_unknown)
+        self.latencies.record(latency)
+        self.version += 1
+        
+    def snapshot(self):
+        # a consistent copy, safe to read while the agent keeps running
+        while True:
+            version = self.version
+            if not version & 1:
+                copy = StatCollection(self.status, self.reason, self.latency, self.count, self.error_count, self.total_latency,
+                    self.total_connect_latency, self.total_bytes, self.new_connections, self.reused_connections, self.latencies.copy(),
+                    self.dns_hits, self.dns_misses, self.tls_full, self.tls_resumed, self.tls_unknown)
+                copy.agent_start_time = self.agent_start_time
+                if self.version == version:
+                    return copy
+            time.sleep(0)  # let the agent finish its update
+            
+    def __getstate__(self):
+        return tuple([getattr(self, name) for name in self.__slots__])
+        
+    def __setstate__(self, state):
+        self.dns_hits = self.dns_misses = self.tls_full = self.tls_resumed = self.tls_unknown = 0  # not in stats pickled before these were counted
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+            
+    def get_avg_latency(self):
+        if self.count > 0:
+            return self.total_latency / self.count
+        return 0
+    avg_latency = property(get_avg_latency)
+    
+    def get_avg_connect_latency(self):
+        if self.count > 0:
+            return self.total_connect_latency / self.count
+        return 0
+    avg_connect_latency = property(get_avg_connect_latency)
+    
+    
+class ErrorQueue:
+    # the most recent error strings, for live display.  a bounded ring buffer: agents append,
+    # a monitor takes what has arrived with drain().  when it is full the oldest errors are dropped
+    def __init__(self, maxsize=ERROR_QUEUE_SIZE):
+        self.errors = collections.deque(maxlen=maxsize)  # append and popleft are atomic, no lock needed
+        
+    def __len__(self):
+        return len(self.errors)
+        
+    def append(self, error):
+        self.errors.append(error)
+        
+    def extend(self, errors):
+        self.errors.extend(errors)
+        
+    def drain(self):
+        errors = []
+        while True:
+            try:
+                errors.append(self.errors.popleft())
+            except IndexError:
+                return errors
+    
+    
+def snapshot_stats(runtime_stats):
+    # consistent copies of every agent's stats, for monitors and reports
+    return dict([(id, stats.snapshot()) for id, stats in runtime_stats.items()])
+    
+    
+    
+    
+class LatencyTracker:
+    # live response time percentiles for the monitors.  each refresh merges the agents' histograms,
+    # and the previous merge is kept so the last refresh window is the difference of the two
+    def __init__(self):
+        self.last = Histogram(precision=LIVE_PRECISION)
+        
+    def update(self, runtime_stats):
+        # runtime_stats as returned by snapshot_stats().  returns (histogram since start, histogram of the last window)
+        total = Histogram(precision=LIVE_PRECISION)
+        for stats in runtime_stats.values():
+            total.merge(stats.latencies)
+        window = total.difference(self.last)
+        self.last = total
+        return (total, window)
+        
+        
+def format_percentiles(histogram, percentiles=(50, 95, 99)):
+    if not histogram.count():
+        return ' / '.join(['-' for percentile in percentiles])
+    return ' / '.join(['%.3f' % histogram.percentile(percentile) for percentile in percentiles])
+            
 
-        self.agent_start_time = None
+
+        
+def discard_body(resp):
+    # read a body in chunks without keeping it.  returns its size
+    resp_bytes = 0
+    while True:
+        chunk = resp.read(DISCARD_CHUNK_SIZE)
+        if not chunk:
+            break
+        resp_bytes += len(chunk)
+    return resp_bytes
+
+
+def read_until_verified(resp, stream):
+    # read a body in chunks, only as far as its VerifyStream needs
+    chunks = []
+    while True:
+        chunk = resp.read(VERIFY_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if stream.feed(chunk):
+            resp.close()  # the rest of the body is dropped along with the connection
+            break
+    return ''.join(chunks)
+
+
+
+
+class ResultsQueue(Queue.Queue):
+    # bounded queue of result rows between the agents and the ResultWriter
+    def __init__(self, maxsize=0):
+        Queue.Queue.__init__(self, maxsize)
+        self.dropped = 0  # rows discarded because the queue was full (RESULTS_QUEUE_FULL = 'drop')
+        self.last_empty = time.time()  # last time the writer had caught up
         
-        if count > 0:
-            self.avg_latency = (total_latency / count)
-            self.avg_connect_latency = (total_connect_latency / count)
+    def add(self, row):
+        if RESULTS_QUEUE_FULL == 'drop':
+            try:
+                self.put(row, False)
+            except Queue.Full:
+                self.mutex.acquire()
+                self.dropped += 1
+                self.mutex.release()
         else:
-            self.avg_latency = 0
-            self.avg_connect_latency = 0
+            self.put(row)  # blocks while the queue is full
             
+    def get_batch(self, max_rows, timeout):
+        # take up to max_rows rows at once, waiting up to timeout secs for the first one
+        self.not_empty.acquire()
+        try:
+            if not self._qsize():
+                self.not_empty.wait(timeout)
+            rows = []
+            while self._qsize() and len(rows) < max_rows:
+                rows.append(self._get())
+            if not self._qsize():
+                self.last_empty = time.time()
+            if rows:
+                self.not_full.notify_all()
+            return rows
+        finally:
+            self.not_empty.release()
+            
+    def lag(self):
+        # secs the writer has been behind, i.e. since the queue was last empty
+        if not self.qsize():
+            return 0.0
+        return time.time() - self.last_empty
+
+
 
 
-        
 class ResultWriter(Thread):
-    # this thread is for reading queued results and writing them to a log file.
+    # this thread is for reading queued results and writing them to a log file and/or binary column files, and rollups.
+    # rows are taken off the queue in batches and written through buffered files, flushed every RESULTS_FLUSH_INTERVAL secs
     def __init__(self, results_queue, output_dir):
         Thread.__init__(self)
         self.running = True
@@ -448,27 +1004,98 @@ class ResultWriter(Thread):
         self.output_dir = output_dir        
 
     def run(self):
-        # make sure a results file always exists, even if no agents finished
-        fh = open('%s/agent_stats.csv' % self.output_dir, 'w')
-        fh.close()
-
-        # The file handle should really be opened once, but this is crashing the
-        # Python interpreter when you quit the console with ctrl-c.  
-        # This is a bug in Python: http://bugs.python.org/issue5160
-        # The workaround is to open/close the handle for each write operation.
-        # File handles are cheap, so don't worry
-        while self.running:
-            try:
-                q_tuple = self.results_queue.get(False)
-                f = open('%s/agent_stats.csv' % self.output_dir, 'a')
-                f.write('%s,%s,%s,%s,%s,%d,%s,%d,%f,%f,%s\n' % q_tuple)  # log as csv
-                f.flush()
-                f.close()
-            except Queue.Empty:
-                # re-check queue for messages every x sec
-                time.sleep(.10)
+        # the results file always exists, even if no agents finished (it stays empty with binary results or rollups only)
+        fh = open('%s/agent_stats.csv' % self.output_dir, 'w', RESULTS_BUFFER_SIZE)
+        write_raw = RAW_RESULTS or not ROLLUP_INTERVAL  # without rollups, the raw results are all there is
+        columns = None
+        rollups = None
+        if write_raw and RESULTS_FORMAT in ('binary', 'both'):
+            import resultstore
+            columns = resultstore.ColumnWriter(self.output_dir)
+        if ROLLUP_INTERVAL:
+            import resultstore
+            rollups = resultstore.RollupWriter(self.output_dir, ROLLUP_INTERVAL)
+        write_csv = write_raw and RESULTS_FORMAT != 'binary'
+        try:
+            last_flush = time.time()
+            while self.running or not self.results_queue.empty():  # drain what is left after stop()
+                rows = self.results_queue.get_batch(RESULTS_BATCH_SIZE, 0.1)
+                if rows and write_csv:
+                    fh.write(''.join(['%s,%s,%s,%s,%s,%d,%s,%d,%f,%f,%s,%f,%f,%f,%f,%f,%f\n' % q_tuple for q_tuple in rows]))  # log as csv
+                if rows and columns:
+                    columns.write(rows)
+                if rows and rollups:
+                    rollups.write(rows)
+                if time.time() - last_flush >= RESULTS_FLUSH_INTERVAL:
+                    fh.flush()
+                    if columns:
+                        columns.flush()
+                    if rollups:
+                        rollups.flush()
+                    last_flush = time.time()
+        finally:
+            fh.close()
+            if columns:
+                columns.close()
+            if rollups:
+                rollups.close()
                 
     def stop(self):
         self.running = False
+        self.join()  # results are generated right after this, so every queued row must be on disk
 
 
+
+
+class TraceWriter(Thread):
+    # writes the agents' request/response messages (-l/--log_msgs) to agent_N.log, off the agent threads.
+    # each message is queued in one piece and written through a buffered (or gzip) file, flushed every TRACE_FLUSH_INTERVAL secs
+    def __init__(self, output_dir, maxsize=TRACE_QUEUE_SIZE):
+        Thread.__init__(self)
+        self.running = True
+        self.output_dir = output_dir
+        self.queue = Queue.Queue(maxsize)
+        self.dropped = 0  # messages discarded because the queue was full
+        self.logs = {}  # agent id -> open message log
+
+    def write(self, id, txt):
+        # called by the agents.  never blocks
+        try:
+            self.queue.put((id, txt), False)
+        except Queue.Full:
+            self.queue.mutex.acquire()
+            self.dropped += 1
+            self.queue.mutex.release()
+
+    def run(self):
+        try:
+            last_flush = time.time()
+            while self.running or not self.queue.empty():  # drain what is left after stop()
+                try:
+                    id, txt = self.queue.get(True, 0.1)
+                    self.log(id).write(txt)
+                except Queue.Empty:
+                    pass
+                except IOError, e:
+                    sys.stderr.write('ERROR: Can not write to message log file\n')
+                if time.time() - last_flush >= TRACE_FLUSH_INTERVAL:
+                    for log in self.logs.values():
+                        log.flush()
+                    last_flush = time.time()
+        finally:
+            for log in self.logs.values():
+                log.close()
+
+    def log(self, id):
+        log = self.logs.get(id)
+        if log is None:
+            if TRACE_COMPRESS:
+                log = gzip.GzipFile('%s/agent_%d.log.gz' % (self.output_dir, id + 1), 'wb', 6)
+            else:
+                log = open('%s/agent_%d.log' % (self.output_dir, id + 1), 'w', TRACE_BUFFER_SIZE)
+            self.logs[id] = log
+        return log
+
+    def stop(self):
+        self.running = False
+        self.join()
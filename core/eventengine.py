@@ -0,0 +1,843 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Event loop engine.  Instead of one OS thread per agent, every virtual user
+#  is a small state machine driven by non-blocking sockets on a single thread.
+#  Selected with ENGINE = 'events' in config.py or "-e events" on the command line.
+#  Results go through the same runtime_stats/error_queue/results_queue as LoadAgent.
+
+
+import errno
+import heapq
+import httplib
+import os
+import select
+import socket
+import ssl
+import sys
+import time
+import urllib2
+from cStringIO import StringIO
+from threading import Lock, Thread
+import config
+import connpool
+import dnscache
+import tlssession
+from engine import AgentBase, AgentContext, ErrorResponse, VerifyStream
+from timing import timer
+
+
+
+COOKIES_ENABLED = config.COOKIES_ENABLED  # default is True
+WAITFOR_AGENT_FINISH = config.WAITFOR_AGENT_FINISH  # default is True
+SOCKET_TIMEOUT = config.SOCKET_TIMEOUT  # secs.  here it limits the whole request, not each socket call
+KEEPALIVE = config.KEEPALIVE  # default is False
+KEEPALIVE_MAX_IDLE = config.KEEPALIVE_MAX_IDLE
+VERIFY_STREAM_LIMIT = config.VERIFY_STREAM_LIMIT  # bytes. default is 0 (read and verify whole bodies)
+DISCARD_BODIES = config.DISCARD_BODIES  # default is False
+
+RECV_SIZE = 65536
+MAX_HEADER_SIZE = 65536
+MAX_REDIRECTS = 10  # same limit as urllib2.HTTPRedirectHandler
+MAX_POLL_WAIT = 0.1  # secs.  how often the loop wakes up to pick up new users and stop requests
+
+READ = 0x001  # same values as select.POLLIN/POLLOUT and select.EPOLLIN/EPOLLOUT
+WRITE = 0x004
+CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)  # 10035 is WSAEWOULDBLOCK
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, 10035)
+
+
+
+class EventLoop(Thread):
+    # runs all virtual users on one thread.  looks like a LoadAgent to AgentGroup (stop/isAlive).
+    # with a scheduler.ArrivalSchedule, users take requests from it instead of pacing themselves
+    def __init__(self, schedule=None):
+        Thread.__init__(self)
+        self.running = True
+        self.schedule = schedule
+        self.idle_users = []  # open model: users waiting for a dispatch
+        self.poller = Poller()
+        self.conns = {}  # fd -> Connection
+        self.timers = []  # heap of (when, seq, callback, args)
+        self.timer_seq = 0
+        self.tick = 0  # poll round counter, see run()
+        self.next_timeout_check = 0
+        self.users = []
+        self.new_users = []  # users added from the LoadManager thread, started on the loop thread
+        self.lock = Lock()
+        raise_fd_limit()
+
+
+    def add_user(self, user):
+        self.lock.acquire()
+        try:
+            self.new_users.append(user)
+        finally:
+            self.lock.release()
+
+
+    def stop(self):
+        self.lock.acquire()
+        try:
+            self.running = False
+            for user in self.users + self.new_users:
+                user.stop()
+        finally:
+            self.lock.release()
+
+
+    def run(self):
+        while self.running or (WAITFOR_AGENT_FINISH and self.busy()):
+            self.start_new_users()
+            if self.schedule and self.running:
+                self.schedule.run_due(time.time(), self.dispatch)
+            timeout = MAX_POLL_WAIT
+            if self.timers:
+                timeout = min(max(self.timers[0][0] - time.time(), 0), timeout)
+            if self.schedule:
+                timeout = min(max(self.schedule.next_time - time.time(), 0), timeout)
+            ready = self.poller.poll(timeout)
+            # sockets opened while handling this round may reuse the fd of one closed in it.
+            # they were not part of the poll, so skip them until the next round
+            self.tick += 1
+            for fd, events in ready:
+                conn = self.conns.get(fd)
+                if conn and conn.tick < self.tick:
+                    user = conn.user
+                    try:
+                        conn.handle(events)
+                    except Exception, e:  # an unexpected error fails that user's request, not the whole loop
+                        conn.close()
+                        if user is not None:
+                            user.on_exception(conn, e)
+            self.run_timers()
+            self.check_timeouts()
+        for conn in self.conns.values():
+            conn.close()
+        for user in self.users:
+            user.finish_run()
+
+
+    def start_new_users(self):
+        if not self.new_users:
+            return
+        self.lock.acquire()
+        try:
+            new_users, self.new_users = self.new_users, []
+            self.users.extend(new_users)
+        finally:
+            self.lock.release()
+        for user in new_users:
+            user.start()
+
+
+    def dispatch(self, req, intended_time):
+        if not self.idle_users:
+            return False
+        self.idle_users.pop().assign(req, intended_time)
+        return True
+
+
+    def busy(self):
+        # true while any user still has a request in flight
+        for user in self.users:
+            if user.conn is not None:
+                return True
+        return False
+
+
+    def check_timeouts(self):
+        now = time.time()
+        if now < self.next_timeout_check:
+            return
+        self.next_timeout_check = now + 1
+        for user in self.users:
+            user.check_timeout(now)
+
+
+    def call_later(self, delay, callback, *args):
+        self.timer_seq += 1
+        heapq.heappush(self.timers, (time.time() + delay, self.timer_seq, callback, args))
+
+
+    def run_timers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            when, seq, callback, args = heapq.heappop(self.timers)
+            try:
+                callback(*args)
+            except Exception, e:  # the user it was for stops, the others go on
+                sys.stderr.write('ERROR: Virtual user failed: %s: %s\n' % (e.__class__.__name__, e))
+
+
+    def register(self, conn, events):
+        conn.tick = self.tick
+        self.conns[conn.fd] = conn
+        self.poller.register(conn.fd, events)
+
+
+    def modify(self, conn, events):
+        self.poller.modify(conn.fd, events)
+
+
+    def unregister(self, conn):
+        if self.conns.pop(conn.fd, None) is not None:
+            self.poller.unregister(conn.fd)
+
+
+
+
+class VirtualUser(AgentBase):
+    # one agent, driven by callbacks from the event loop instead of a thread
+    def __init__(self, loop, id, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, trace_writer=None):
+        AgentBase.__init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, results_queue, trace_writer)
+        self.loop = loop
+
+        self.context = AgentContext(msg_queue)
+        self.case_idx = 0
+        self.repeat_idx = 0
+        self.next_intended_start = None  # when the pacing schedule wants the next request sent
+
+        self.idle_conns = {}  # (scheme, host, port) -> Connection, only used with keep-alive
+        self.conn = None  # connection of the request in flight
+        self.conn_reused = False
+        self.deadline = 0  # give up on the request in flight after this time
+
+
+    def start(self):
+        self.mark_started()
+        if self.loop.schedule:
+            self.loop.idle_users.append(self)  # open model: wait to be dispatched
+        else:
+            self.next_request()
+
+
+    def stop(self):
+        self.running = False
+
+
+    def finish_run(self):
+        for conn in self.idle_conns.values():
+            conn.close()
+        self.idle_conns = {}
+        self.close_error_log()
+        if self.trace_logging:
+            self.disable_trace_logging()
+
+
+    def next_request(self):
+        req = None
+        if self.running:
+            req = self.next_case()
+        if req is None:
+            for conn in self.idle_conns.values():
+                conn.close()
+            self.idle_conns = {}
+            return
+        if self.interval:
+            self.send(req, self.next_intended_start)  # None for the first request, which starts the schedule
+        else:
+            self.send(req, None)  # no schedule, record() measures from req_start_time
+
+
+    def assign(self, req, intended_time):
+        # open model: the loop's scheduler hands us a request.  like DispatchedAgent, each one is a pass of its own
+        self.context.new_pass()
+        self.send(req, intended_time - time.time() + self.default_timer())  # schedule runs on wall clock time
+
+
+    def send(self, req, intended_start):
+        self.req = req
+        self.intended_start = intended_start
+        if req.method.upper() == 'POST':
+            self.request = urllib2.Request(req.url, req.body, req.headers)
+        else:
+            self.request = urllib2.Request(req.url, None, req.headers)  # same as LoadAgent.send
+        self.redirects = 0
+        self.retried = False
+        self.verify_stream = None
+        if VERIFY_STREAM_LIMIT and (req.verify or req.verify_negative):
+            self.verify_stream = VerifyStream(req, VERIFY_STREAM_LIMIT)
+        self.connect_end_time = None
+        self.phases.reset()
+        self.req_start_time = self.default_timer()
+        self.begin()
+
+
+    def next_case(self):
+        # walk the test cases in order, honoring repeat.  a new pass starts with a fresh cookie jar
+        context = self.context
+        for attempt in range(len(context.order) + 1):
+            if self.case_idx >= len(context.order):
+                self.case_idx = 0
+                context.new_pass()
+            if not context.order:
+                return None
+            req = context.msg_queue[context.order[self.case_idx]]
+            if self.repeat_idx < req.repeat:
+                self.repeat_idx += 1
+                return req
+            self.case_idx += 1
+            self.repeat_idx = 0
+        return None  # every case has repeat=0
+
+
+    def begin(self, fresh=False):
+        request = self.request
+        if COOKIES_ENABLED:
+            self.context.cookie_jar.add_cookie_header(request)
+        scheme = request.get_type()
+        host, port = urllib2.splitport(request.get_host())
+        if port:
+            port = int(port)
+        else:
+            port = httplib.HTTPS_PORT if scheme == 'https' else httplib.HTTP_PORT
+        key = (scheme, host, port)
+
+        self.deadline = time.time() + SOCKET_TIMEOUT
+        self.verify_fed = 0  # body chunks of the current response already given to verify_stream
+
+        conn = self.idle_conns.pop(key, None)
+        if conn and not fresh and conn.state == 'idle' and (time.time() - conn.last_used) <= KEEPALIVE_MAX_IDLE:
+            self.reused_connections += 1
+            self.conn_reused = True
+        else:
+            if conn:
+                conn.close()
+            conn = Connection(self.loop, key, self.phases, self.tls_sessions)
+            self.conn_reused = False
+        self.conn = conn
+        keep_body = not DISCARD_BODIES or self.req.verify or self.req.verify_negative or self.trace_logging
+        try:
+            if conn.state is None:
+                conn.open()
+            conn.send_request(self, serialize_request(request), ResponseParser(request.get_method(), keep_body))
+        except (socket.error, httplib.HTTPException), e:
+            # failed before we got to the loop (e.g. name resolution).  complete the request from the loop,
+            # or with interval 0 the next request would start inside this one and recurse without end
+            self.loop.call_later(0, self.on_error, conn, e)
+
+
+    def on_headers(self, conn):
+        # like LoadAgent, "connect" time ends when the response headers have arrived
+        self.connect_end_time = self.default_timer()
+
+
+    def body_verified(self, parser):
+        # with VERIFY_STREAM_LIMIT, tells the connection to stop receiving once the body has been checked far enough
+        if self.verify_stream is None or parser.status in (301, 302, 303, 307) or parser.status >= 400:
+            return False
+        chunks = parser.chunks
+        while self.verify_fed < len(chunks):
+            self.verify_fed += 1
+            if self.verify_stream.feed(chunks[self.verify_fed - 1]):
+                return True
+        return False
+
+
+    def on_response(self, conn, parser):
+        self.conn = None
+        resp = EventResponse(parser)
+        request = self.request
+        if COOKIES_ENABLED:
+            self.context.cookie_jar.extract_cookies(resp, request)
+        if KEEPALIVE and conn.state == 'idle':
+            conn.last_used = time.time()
+            self.idle_conns[conn.key] = conn
+
+        location = resp.headers.get('location') or resp.headers.get('uri')
+        if resp.code in (301, 302, 303, 307) and location and self.redirects < MAX_REDIRECTS:
+            self.redirects += 1
+            self.request = connpool.redirect_request(request, resp.code, location)
+            self.begin()
+            return
+
+        if resp.code >= 400:  # same as the urllib2.HTTPError handling in LoadAgent.send
+            error_resp = ErrorResponse()
+            error_resp.code = resp.code
+            error_resp.msg = httplib.responses.get(resp.code, parser.reason)
+            error_resp.headers = dict(resp.headers)
+            self.complete(error_resp, '')
+        else:
+            self.complete(resp, parser.body(), parser.size)
+
+
+    def on_error(self, conn, e):
+        self.conn = None
+        if self.conn_reused and not conn.got_bytes and not self.retried:
+            # the server closed the idle connection under us.  retry once on a fresh one
+            self.retried = True
+            self.begin(fresh=True)
+            return
+        resp = ErrorResponse()
+        resp.code = 0
+        resp.msg = str(e)
+        resp.headers = {}
+        self.complete(resp, '')
+
+
+    def on_exception(self, conn, e):
+        # one of our callbacks raised.  record the request in flight as an error, from the loop
+        self.conn = None
+        self.retried = True
+        self.loop.call_later(0, self.on_error, conn, e)
+
+
+    def check_timeout(self, now):
+        if self.conn is not None and now > self.deadline:
+            self.conn.fail(socket.timeout('timed out'))
+
+
+    def complete(self, resp, content, resp_bytes=None):
+        req_end_time = self.default_timer()
+        if self.connect_end_time is None:
+            self.connect_end_time = req_end_time
+
+        if self.trace_logging:
+            # log request/response messages
+            self.log_http_msgs(self.req, self.request, resp, content, req_end_time - self.req_start_time)
+
+        self.record(self.req, resp, content, self.req_start_time, req_end_time, self.connect_end_time, self.intended_start, resp_bytes)
+
+        if self.loop.schedule:
+            if self.running:
+                self.loop.idle_users.append(self)
+            return
+
+        # wait until the next request is due, like LoadAgent.run
+        if self.interval:
+            due = self.intended_start
+            if due is None:
+                due = self.req_start_time
+            self.next_intended_start = due + self.interval + (self.req.wait / 1000.0)
+            delay = self.next_intended_start - self.default_timer()
+        else:
+            delay = self.req.wait / 1000.0
+        self.loop.call_later(max(delay, 0), self.next_request)  # from the loop, on a fresh stack
+
+
+
+
+class Connection:
+    # one non-blocking client socket.  states: connecting, handshake, sending, receiving, idle, closed
+    def __init__(self, loop, key, phases, tls_sessions):
+        self.loop = loop
+        self.key = key  # (scheme, host, port)
+        self.phases = phases  # timing.Phases of the user that opened it, for the setup times
+        self.tls_sessions = tls_sessions  # tlssession.SessionCache of that user
+        self.setup_start = None  # start of the connect or the handshake in progress
+        self.state = None
+        self.sock = None
+        self.fd = None
+        self.user = None
+        self.parser = None
+        self.out = ''
+        self.got_bytes = False
+        self.last_used = 0
+        self.tick = 0  # poll round the socket was registered in
+
+
+    def open(self):
+        scheme, host, port = self.key
+        # note: name resolution is a blocking call, unless the dnscache has the host
+        start = timer()
+        addrs, is_hit = dnscache.cache.getaddrinfo(host, port)
+        family, socktype, proto, canonname, addr = addrs[0]
+        self.setup_start = timer()
+        self.phases.dns += self.setup_start - start
+        self.phases.count_lookup(is_hit)
+        self.sock = socket.socket(family, socktype, proto)
+        self.sock.setblocking(0)
+        self.fd = self.sock.fileno()
+        err = self.sock.connect_ex(addr)
+        if err and err not in CONNECT_IN_PROGRESS:
+            self.sock.close()
+            raise socket.error(err, os.strerror(err))
+        self.phases.connections += 1
+        self.state = 'connecting'
+        self.loop.register(self, WRITE)
+
+
+    def send_request(self, user, data, parser):
+        self.user = user
+        self.parser = parser
+        self.out = data
+        self.got_bytes = False
+        if self.state == 'idle':
+            self.state = 'sending'
+            self.loop.modify(self, WRITE)
+
+
+    def handle(self, events):
+        try:
+            if self.state == 'connecting':
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise socket.error(err, os.strerror(err))
+                now = timer()
+                self.phases.connect += now - self.setup_start
+                self.setup_start = now
+                if self.key[0] == 'https':
+                    self.sock = self.tls_sessions.wrap_socket(self.sock, self.key[1], self.key[2], do_handshake=False)
+                    self.state = 'handshake'
+                    self.do_handshake()
+                else:
+                    self.state = 'sending'
+                    self.do_send()
+            elif self.state == 'handshake':
+                self.do_handshake()
+            elif self.state == 'sending':
+                self.do_send()
+            elif self.state == 'receiving':
+                self.do_recv()
+            elif self.state == 'idle':
+                self.close()  # pooled connection became readable: the server closed it (or sent junk)
+        except (socket.error, httplib.HTTPException, ValueError), e:
+            self.fail(e)
+
+
+    def do_handshake(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.loop.modify(self, READ)
+            return
+        except ssl.SSLWantWriteError:
+            self.loop.modify(self, WRITE)
+            return
+        self.phases.tls += timer() - self.setup_start
+        self.phases.count_handshake(tlssession.is_resumed(self.sock))
+        self.state = 'sending'
+        self.do_send()
+
+
+    def do_send(self):
+        try:
+            sent = self.sock.send(self.out)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        except socket.error, e:
+            if e.args[0] in WOULD_BLOCK:
+                return
+            raise
+        self.out = self.out[sent:]
+        if self.out:
+            self.loop.modify(self, WRITE)
+        else:
+            self.state = 'receiving'
+            self.loop.modify(self, READ)
+
+
+    def do_recv(self):
+        while True:
+            try:
+                data = self.sock.recv(RECV_SIZE)
+            except ssl.SSLWantReadError:
+                return
+            except socket.error, e:
+                if e.args[0] in WOULD_BLOCK:
+                    return
+                raise
+            if not data:
+                self.parser.feed_eof()  # raises if the response is incomplete
+                self.complete()
+                return
+            self.got_bytes = True
+            had_headers = self.parser.status is not None
+            done = self.parser.feed(data)
+            if not had_headers and self.parser.status is not None:
+                self.user.on_headers(self)
+            if done:
+                self.complete()
+                return
+            if self.parser.status is not None and self.user.body_verified(self.parser):
+                self.parser.will_close = True  # the rest of the body is dropped along with the connection
+                self.complete()
+                return
+            if not hasattr(self.sock, 'pending') or not self.sock.pending():  # ssl.SSLSocket or tlssession.TLSSocket
+                return  # level triggered, so the loop will call us again for the rest
+
+
+    def complete(self):
+        user, parser = self.user, self.parser
+        self.user = None
+        self.parser = None
+        if parser.will_close or not KEEPALIVE:
+            self.close()
+        else:
+            self.state = 'idle'
+            self.loop.modify(self, READ)  # notice the server closing the idle connection
+        user.on_response(self, parser)
+
+
+    def fail(self, e):
+        user = self.user
+        self.user = None
+        self.parser = None
+        self.close()
+        if user:
+            user.on_error(self, e)
+
+
+    def close(self):
+        if self.state == 'closed':
+            return
+        self.state = 'closed'
+        if self.sock:
+            self.loop.unregister(self)
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+
+
+
+
+class ResponseParser:
+    # incremental HTTP/1.x response parser, fed from non-blocking reads
+    def __init__(self, method, keep_body=True):
+        self.method = method.upper()
+        self.keep_body = keep_body  # False only counts the body bytes
+        self.buf = ''
+        self.state = 'head'  # head, length, chunk_size, chunk_data, trailer, close, done
+        self.status = None  # set once the headers are complete
+        self.reason = ''
+        self.headers = None
+        self.will_close = False
+        self.remaining = 0
+        self.chunks = []
+        self.size = 0
+
+
+    def body(self):
+        return ''.join(self.chunks)
+
+
+    def add_chunk(self, chunk):
+        self.size += len(chunk)
+        if self.keep_body:
+            self.chunks.append(chunk)
+
+
+    def feed(self, data):
+        # returns True when the response is complete
+        self.buf += data
+        while True:
+            if self.state == 'head':
+                idx = self.buf.find('\r\n\r\n')
+                if idx < 0:
+                    if len(self.buf) > MAX_HEADER_SIZE:
+                        raise httplib.LineTooLong('header')
+                    return False
+                head, self.buf = self.buf[:idx], self.buf[idx + 4:]
+                self.parse_head(head)
+            elif self.state == 'length':
+                chunk, self.buf = self.buf[:self.remaining], self.buf[self.remaining:]
+                self.add_chunk(chunk)
+                self.remaining -= len(chunk)
+                if self.remaining:
+                    return False
+                self.state = 'done'
+            elif self.state == 'chunk_size':
+                idx = self.buf.find('\r\n')
+                if idx < 0:
+                    return False
+                line, self.buf = self.buf[:idx], self.buf[idx + 2:]
+                try:
+                    size = int(line.split(';', 1)[0], 16)
+                except ValueError:
+                    raise httplib.IncompleteRead(self.body())
+                if size == 0:
+                    self.state = 'trailer'
+                else:
+                    self.remaining = size
+                    self.state = 'chunk_data'
+            elif self.state == 'chunk_data':
+                if len(self.buf) < self.remaining + 2:
+                    return False
+                self.add_chunk(self.buf[:self.remaining])
+                self.buf = self.buf[self.remaining + 2:]  # skip the CRLF after each chunk
+                self.state = 'chunk_size'
+            elif self.state == 'trailer':
+                idx = self.buf.find('\r\n')
+                if idx < 0:
+                    return False
+                line, self.buf = self.buf[:idx], self.buf[idx + 2:]
+                if line == '':
+                    self.state = 'done'
+            elif self.state == 'close':
+                self.add_chunk(self.buf)
+                self.buf = ''
+                return False
+            if self.state == 'done':
+                return True
+
+
+    def feed_eof(self):
+        if self.state == 'close':
+            self.state = 'done'
+        elif self.state != 'done':
+            if self.status is None:
+                raise httplib.BadStatusLine(self.buf)
+            raise httplib.IncompleteRead(self.body())
+
+
+    def parse_head(self, head):
+        lines = head.split('\r\n')
+        parts = lines[0].split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise httplib.BadStatusLine(lines[0])
+        try:
+            status = int(parts[1])
+        except ValueError:
+            raise httplib.BadStatusLine(lines[0])
+        if status == 100:
+            return  # skip "100 Continue" and wait for the real response
+        self.status = status
+        if len(parts) == 3:
+            self.reason = parts[2].strip()
+        self.headers = httplib.HTTPMessage(StringIO('\r\n'.join(lines[1:]) + '\r\n\r\n'), 0)
+
+        connection = self.headers.get('connection', '').lower()
+        if parts[0] == 'HTTP/1.0':
+            self.will_close = 'keep-alive' not in connection
+        else:
+            self.will_close = 'close' in connection
+
+        if self.method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self.state = 'done'
+        elif 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            self.state = 'chunk_size'
+        elif self.headers.get('content-length') is not None:
+            try:
+                self.remaining = int(self.headers.get('content-length'))
+            except ValueError:
+                raise httplib.HTTPException('invalid content-length')
+            self.state = 'length' if self.remaining > 0 else 'done'
+        else:
+            self.state = 'close'  # body ends when the server closes the connection
+            self.will_close = True
+
+
+
+
+class EventResponse:
+    # looks like the response returned by an urllib2 opener
+    def __init__(self, parser):
+        self.code = parser.status
+        self.msg = parser.reason
+        self.headers = parser.headers
+
+
+    def info(self):
+        return self.headers
+
+
+
+
+class Poller:
+    # readiness notification using the best API available: epoll, poll, then select
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.impl = select.epoll()
+            self.kind = 'epoll'
+        elif hasattr(select, 'poll'):
+            self.impl = select.poll()
+            self.kind = 'poll'
+        else:  # windows.  select() is limited to 512 sockets there
+            self.readers = set()
+            self.writers = set()
+            self.kind = 'select'
+
+
+    def register(self, fd, events):
+        if self.kind == 'select':
+            self.modify(fd, events)
+        else:
+            self.impl.register(fd, events)
+
+
+    def modify(self, fd, events):
+        if self.kind == 'select':
+            self.readers.discard(fd)
+            self.writers.discard(fd)
+            if events & READ:
+                self.readers.add(fd)
+            if events & WRITE:
+                self.writers.add(fd)
+        else:
+            self.impl.modify(fd, events)
+
+
+    def unregister(self, fd):
+        if self.kind == 'select':
+            self.readers.discard(fd)
+            self.writers.discard(fd)
+        else:
+            self.impl.unregister(fd)
+
+
+    def poll(self, timeout):
+        try:
+            if self.kind == 'epoll':
+                return self.impl.poll(timeout)
+            elif self.kind == 'poll':
+                return self.impl.poll(timeout * 1000)
+            if not self.readers and not self.writers:
+                time.sleep(timeout)
+                return []
+            readable, writable, exceptional = select.select(self.readers, self.writers, self.writers, timeout)
+        except (select.error, IOError), e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        events = {}
+        for fd in readable:
+            events[fd] = READ
+        for fd in writable + exceptional:
+            events[fd] = events.get(fd, 0) | WRITE
+        return events.items()
+
+
+
+
+def serialize_request(request):
+    # build the raw HTTP/1.1 message for a urllib2.Request
+    data = request.get_data()
+    headers = request.header_items()
+    names = [name.lower() for name, value in headers]
+    lines = ['%s %s HTTP/1.1' % (request.get_method(), request.get_selector())]
+    if 'host' not in names:
+        lines.append('Host: %s' % request.get_host())
+    for name, value in headers:
+        lines.append('%s: %s' % (name, value))
+    if data is not None:
+        if 'content-type' not in names:
+            lines.append('Content-Type: application/x-www-form-urlencoded')  # urllib2 default
+        if 'content-length' not in names:
+            lines.append('Content-Length: %d' % len(data))
+    return '\r\n'.join(lines) + '\r\n\r\n' + (data or '')
+
+
+def raise_fd_limit():
+    # every virtual user holds a socket, so allow as many open files as the OS will give us
+    try:
+        import resource  # unix only
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, resource.error):
+        pass
@@ -12,17 +12,21 @@
 #
 
 
-import sys
+import math
 
 try:
-    from pylab import *  # Matplotlib for graphing.  Only used on systems that have it installed.
+    import matplotlib  # Matplotlib for graphing.  Only used on systems that have it installed.
+    matplotlib.use('Agg')  # draw straight to png files.  no display or GUI toolkit needed
+    from pylab import *
+    IMPORT_ERROR = None
 except ImportError, e:
-    sys.stderr.write('Matplotlib ImportError: %s\n' % e)
+    IMPORT_ERROR = e  # reported by results.draw_graph
     
 
 
-# response time graph
-def resp_graph(nested_resp_list, dir='./'):
+# response time graph.  drawn from time buckets (see results.bin_latencies), not single responses,
+# so its cost depends on the image width rather than the request count
+def resp_graph(latency_bins, dir='./'):
     fig = figure(figsize=(8, 3))  # image dimensions  
     ax = fig.add_subplot(111)
     ax.set_xlabel('Elapsed Time In Test (secs)', size='x-small')
@@ -30,16 +34,59 @@ def resp_graph(nested_resp_list, dir='./'):
     ax.grid(True, color='#666666')
     xticks(size='x-small')
     yticks(size='x-small')
-    axis(xmin=0)
-    x_seq = [item[0] for item in nested_resp_list] 
-    y_seq = [item[1] for item in nested_resp_list] 
-    ax.plot(x_seq, y_seq, 
+    latency_bins = [(secs, latencies) for secs, latencies in latency_bins if latencies.count()]
+    x_seq = [secs for secs, latencies in latency_bins]
+    min_seq = [latencies.min() for secs, latencies in latency_bins]
+    max_seq = [latencies.max() for secs, latencies in latency_bins]
+    median_seq = [latencies.percentile(50) for secs, latencies in latency_bins]
+    pct95_seq = [latencies.percentile(95) for secs, latencies in latency_bins]
+    pct99_seq = [latencies.percentile(99) for secs, latencies in latency_bins]
+    ax.fill_between(x_seq, min_seq, max_seq, color='#ccccff', linewidth=0, label='min - max')
+    ax.fill_between(x_seq, median_seq, pct95_seq, color='#8888ff', linewidth=0, label='50th - 95th %')
+    ax.plot(x_seq, median_seq, 
         color='blue', linestyle='-', linewidth=1.0, marker='o', 
-        markeredgecolor='blue', markerfacecolor='yellow', markersize=2.0)
+        markeredgecolor='blue', markerfacecolor='yellow', markersize=2.0, label='50th %')
+    ax.plot(x_seq, pct99_seq, color='red', linestyle='-', linewidth=1.0, label='99th %')
+    ax.legend(loc='upper left', prop={'size': 'x-small'})
+    axis(xmin=0)  # after plotting, setting a limit first stops the axis from scaling to the data
     savefig(dir + 'response_time_graph.png') 
     
     
 
+# response time heatmap.  requests per time bucket (x) and response time bucket (y, log scale)
+def latency_heatmap(latency_bins, dir='./', rows=50):
+    fig = figure(figsize=(8, 3))  # image dimensions  
+    ax = fig.add_subplot(111)
+    ax.set_xlabel('Elapsed Time In Test (secs)', size='x-small')
+    ax.set_ylabel('Response Time (secs)' , size='x-small')
+    xticks(size='x-small')
+    yticks(size='x-small')
+    lowest = min([latencies.min() for secs, latencies in latency_bins if latencies.count()])
+    highest = max([latencies.max() for secs, latencies in latency_bins if latencies.count()])
+    lowest = max(lowest, 0.000001)  # the log scale starts above 0
+    highest = max(highest, lowest * 2)
+    log_span = math.log(highest / lowest)
+    y_edges = [lowest * math.exp(log_span * row / rows) for row in range(rows + 1)]
+    counts = zeros((rows, len(latency_bins)))
+    for col, (secs, latencies) in enumerate(latency_bins):
+        for idx, count in latencies.counts.iteritems():
+            value = min(max(latencies.bucket_value(idx), lowest), highest)
+            row = min(int(math.log(value / lowest) / log_span * rows), rows - 1)
+            counts[row, col] += count
+    if len(latency_bins) > 1:
+        width = latency_bins[1][0] - latency_bins[0][0]
+    else:
+        width = 1
+    x_edges = [secs for secs, latencies in latency_bins] + [latency_bins[-1][0] + width]
+    mesh = ax.pcolormesh(array(x_edges), array(y_edges), ma.masked_equal(counts, 0), cmap=cm.YlOrRd)
+    ax.set_yscale('log')
+    ax.set_xlim(x_edges[0], x_edges[-1])
+    ax.set_ylim(y_edges[0], y_edges[-1])
+    colorbar(mesh).set_label('Requests (count)', size='x-small')
+    savefig(dir + 'latency_heatmap.png') 
+    
+    
+
 # throughput graph
 def tp_graph(throughputs_dict, dir='./'):
     fig = figure(figsize=(8, 3))  # image dimensions  
@@ -49,7 +96,6 @@ def tp_graph(throughputs_dict, dir='./'):
     ax.grid(True, color='#666666')
     xticks(size='x-small')
     yticks(size='x-small')
-    axis(xmin=0)
     keys = throughputs_dict.keys()
     keys.sort()
     values = []
@@ -60,5 +106,6 @@ def tp_graph(throughputs_dict, dir='./'):
     ax.plot(x_seq, y_seq, 
         color='red', linestyle='-', linewidth=1.0, marker='o', 
         markeredgecolor='red', markerfacecolor='yellow', markersize=2.0)
+    axis(xmin=0)
     savefig(dir + 'throughput_graph.png') 
     
\ No newline at end of file
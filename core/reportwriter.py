@@ -16,6 +16,10 @@ import time
 
 
 
+PHASE_NAMES = {'dns': 'DNS lookup', 'connect': 'TCP connect', 'tls': 'TLS handshake', 'ttfb': 'Time to first byte', 'transfer': 'Transfer'}
+
+
+
 def write_starting_content(handle, test_name):
     if test_name:
         handle.write('<h1>Pylot - %s Performance Results</h1>\n' % test_name)
@@ -26,6 +30,8 @@ def write_starting_content(handle, test_name):
 def write_images(handle):
     handle.write('<h2>Response Time</h2>\n')
     handle.write('<img src="response_time_graph.png" alt="response time graph">\n')
+    handle.write('<h2>Response Time Distribution</h2>\n')
+    handle.write('<img src="latency_heatmap.png" alt="response time heatmap">\n')
     handle.write('<h2>Throughput</h2>\n')
     handle.write('<img src="throughput_graph.png" alt="throughput graph">\n')
 
@@ -33,7 +39,7 @@ def write_images(handle):
 def write_stats_tables(handle, stats_dict):
     handle.write('<p><br /></p>')
     handle.write('<table>\n')
-    handle.write('<th>Response Time (secs)</th><th>Throughput (req/sec)</th>\n')
+    handle.write('<th>Response Time (secs)</th><th>Corrected Response Time (secs)</th><th>Throughput (req/sec)</th>\n')
     handle.write('<tr>\n')
     handle.write('<td>\n')   
     handle.write('<table>\n')
@@ -49,6 +55,14 @@ def write_stats_tables(handle, stats_dict):
     handle.write('</table>\n')
     handle.write('</td>\n')
     handle.write('<td>\n')
+    # measured from the intended send time, so stalls that delayed later requests are included
+    handle.write('<table>\n')
+    handle.write('<tr><td>%s</td><td>%.3f</td></tr>\n' % ('90th %', stats_dict['corrected_90pct']))
+    handle.write('<tr><td>%s</td><td>%.3f</td></tr>\n' % ('95th %', stats_dict['corrected_95pct']))
+    handle.write('<tr><td>%s</td><td>%.3f</td></tr>\n' % ('99th %', stats_dict['corrected_99pct']))
+    handle.write('</table>\n')
+    handle.write('</td>\n')
+    handle.write('<td>\n')
     handle.write('<table>\n')
     handle.write('<tr><td>%s</td><td>%.3f</td></tr>\n' % ('avg', stats_dict['throughput_avg']))
     handle.write('<tr><td>%s</td><td>%.3f</td></tr>\n' % ('stdev', stats_dict['throughput_stdev']))
@@ -75,21 +89,41 @@ def write_summary_results(handle, summary_dict, workload_dict):
     handle.write('<table>\n')
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('test duration (secs)', summary_dict['duration']))
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('agents', summary_dict['num_agents']))
+    if workload_dict.get('nodes'):
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('nodes', workload_dict['nodes']))
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('rampup (secs)', workload_dict['rampup']))
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('interval (millisecs)', workload_dict['interval']))
+    if workload_dict.get('arrival_rate'):
+        handle.write('<tr><td>%s</td><td>%.2f</td></tr>\n' % ('arrival rate (req/sec)', workload_dict['arrival_rate']))
     handle.write('</table>\n')
     handle.write('<h2>Results Summary</h2>')
     handle.write('<table>\n')
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('requests', summary_dict['req_count']))
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('errors', summary_dict['err_count']))
     handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('data received (bytes)', summary_dict['bytes_received']))
+    handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('connections opened', summary_dict['new_connections']))
+    handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('connections reused', summary_dict['reused_connections']))
+    if summary_dict['dns_hits'] or summary_dict['dns_misses']:
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('DNS cache hits', summary_dict['dns_hits']))
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('DNS cache misses (lookups)', summary_dict['dns_misses']))
+    if summary_dict['tls_full'] or summary_dict['tls_resumed']:
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('TLS handshakes (full)', summary_dict['tls_full']))
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('TLS handshakes (resumed session)', summary_dict['tls_resumed']))
+    if summary_dict['tls_unknown']:
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('TLS handshakes (resumption unknown)', summary_dict['tls_unknown']))
+    if workload_dict.get('arrival_rate'):
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('dispatches', workload_dict['dispatched']))
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('dropped dispatches (all agents busy)', workload_dict['dropped_dispatches']))
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('late dispatches', workload_dict['late_dispatches']))
+    if workload_dict.get('results_dropped'):
+        handle.write('<tr><td>%s</td><td>%d</td></tr>\n' % ('dropped results (results queue full)', workload_dict['results_dropped']))
     handle.write('</table>\n')
     
 
 def write_agent_detail_table(handle, runtime_stats_dict):
     handle.write('<h2>Agent Details</h2>\n')
     handle.write('<table>\n')
-    handle.write('<th>Agent</th><th>Start Time</th><th>Requests</th><th>Errors</th><th>Bytes Received</th><th>Avg Response Time (secs)</th><th>Avg Connect Time (secs)</th>\n')
+    handle.write('<th>Agent</th><th>Start Time</th><th>Requests</th><th>Errors</th><th>Bytes Received</th><th>Avg Response Time (secs)</th><th>Avg Connect Time (secs)</th><th>New Connections</th><th>Reused Connections</th>\n')
     for i in range(len(runtime_stats_dict)):
         agent_num = i + 1
         agent_start_time = runtime_stats_dict[i].agent_start_time
@@ -98,8 +132,10 @@ def write_agent_detail_table(handle, runtime_stats_dict):
         total_bytes = runtime_stats_dict[i].total_bytes
         avg_latency = runtime_stats_dict[i].avg_latency
         avg_connect_latency = runtime_stats_dict[i].avg_connect_latency
-        handle.write('<tr> <td>%d</td><td>%s</td><td>%d</td><td>%d</td><td>%d</td><td>%.3f</td><td>%.3f</td> </tr>\n' % 
-            (agent_num, agent_start_time, count, error_count, total_bytes, avg_latency, avg_connect_latency))
+        new_connections = runtime_stats_dict[i].new_connections
+        reused_connections = runtime_stats_dict[i].reused_connections
+        handle.write('<tr> <td>%d</td><td>%s</td><td>%d</td><td>%d</td><td>%d</td><td>%.3f</td><td>%.3f</td><td>%d</td><td>%d</td> </tr>\n' % 
+            (agent_num, agent_start_time, count, error_count, total_bytes, avg_latency, avg_connect_latency, new_connections, reused_connections))
     handle.write('</table>\n')
 
 
@@ -119,6 +155,41 @@ def write_timer_group_stats(handle, timer_group_stats):
     handle.write('</table>\n')
     
 
+def write_url_stats(handle, url_stats):
+    handle.write('<p><br /></p>')
+    handle.write('<h2>URLs - Response Times (slowest 99th % first)</h2>\n')
+    handle.write('<table>\n')
+    handle.write('<th>Request URL</th><th>Count</th><th>avg</th><th>min</th><th>50th %</th><th>90th %</th><th>95th %</th><th>99th %</th><th>max</th>\n')
+    for stat_list in url_stats:
+        handle.write('<tr> <td>%s</td> <td>%i</td> <td>%.3f</td> <td>%.3f</td> <td>%.3f</td> <td>%.3f</td> <td>%.3f</td> <td>%.3f</td> <td>%.3f</td> </tr>\n' % tuple(stat_list))
+    handle.write('</table>\n')
+    
+    
+def write_phase_stats(handle, phase_stats):
+    # where the time of a request goes: name resolution, TCP connect, TLS handshake, time to first byte, body transfer
+    if not phase_stats:
+        return
+    handle.write('<p><br /></p>')
+    handle.write('<h2>Request Phases - Response Times (secs)</h2>\n')
+    handle.write('<table>\n')
+    handle.write('<th>Phase</th><th>avg</th><th>min</th><th>50th %</th><th>90th %</th><th>95th %</th><th>99th %</th><th>max</th>\n')
+    for stat_list in phase_stats:
+        stat_list = [PHASE_NAMES.get(stat_list[0], stat_list[0])] + stat_list[1:]
+        handle.write('<tr> <td>%s</td> <td>%.4f</td> <td>%.4f</td> <td>%.4f</td> <td>%.4f</td> <td>%.4f</td> <td>%.4f</td> <td>%.4f</td> </tr>\n' % tuple(stat_list))
+    handle.write('</table>\n')
+    
+    
+def write_error_summary(handle, error_summary):
+    handle.write('<p><br /></p>')
+    handle.write('<h2>Errors</h2>\n')
+    handle.write('<table>\n')
+    handle.write('<th>Status</th><th>Reason</th><th>Request URL</th><th>Count</th><th>First</th><th>Last</th>\n')
+    for status, reason, url, count, first_time, last_time in error_summary:
+        handle.write('<tr> <td>%d</td> <td>%s</td> <td>%s</td> <td>%d</td> <td>%s</td> <td>%s</td> </tr>\n' % (status, reason, url, count, 
+            time.strftime('%H:%M:%S', time.localtime(first_time)), time.strftime('%H:%M:%S', time.localtime(last_time))))
+    handle.write('</table>\n')
+    
+    
 def write_best_worst_requests(handle, best_times, worst_times):
     handle.write('<p><br /></p>')
     handle.write('<h2>Fastest Responding URLs</h2>\n')
@@ -13,46 +13,66 @@
 
 
 import glob
+import math
+import os
 import pickle
 import sys
 import time
+from array import array
 from threading import Thread
 import corestats
 import reportwriter
+import resultstore
+import timing
 import config
 
 
 
 SMOOTH_TP_GRAPH = config.SMOOTH_TP_GRAPH  # smooth/dampen the throughput graph based on an interval.  default is 3 secs
+EXACT_PERCENTILES = config.EXACT_PERCENTILES  # default is False (percentiles from histograms)
+GRAPH_PROCESSES = config.GRAPH_PROCESSES  # default is 3
+GRAPH_BINS = 400  # max time buckets in the response time graphs, about one per 2 pixels.  bounds the graphing work
 
 
 
 def generate_results(dir, test_name):
     print '\nGenerating Results...'
-    try:
-        merged_log = open(dir + '/agent_stats.csv', 'rb').readlines()  # this log contains commingled results from all agents
-    except IOError:
-        sys.stderr.write('ERROR: Can not find your results log file\n')
-    merged_error_log = merge_error_files(dir)
+    # one pass over the commingled results from all agents feeds every statistic in the report.
+    # the rollups written during the test hold the same totals per second, unless exact percentiles are wanted
+    if corestats.numpy is not None and resultstore.has_columns(dir):
+        aggregator = ColumnAggregator(resultstore.ColumnReader(dir))
+    elif resultstore.has_rollups(dir) and not (EXACT_PERCENTILES and has_raw_results(dir)):
+        aggregator = RollupAggregator(resultstore.RollupReader(dir))
+    else:
+        aggregator = ResultsAggregator()
+        for row in iter_results(dir):
+            aggregator.add(row)
+    error_summary = merge_error_files(dir)
     
-    if len(merged_log) == 0:
+    if aggregator.count == 0:
         fh = open(dir + '/results.html', 'w')
         fh.write(r'<html><body><p>None of the agents finished successfully.  There is no data to report.</p></body></html>\n')
         fh.close()
         sys.stdout.write('ERROR: None of the agents finished successfully.  There is no data to report.\n')
         return
 
-    timings = list_timings(merged_log)
-    best_times, worst_times = best_and_worst_requests(merged_log)
-    timer_group_stats = get_timer_groups(merged_log)
-    timing_secs = [int(x[0]) for x in timings]  # grab just the secs (rounded-down)
-    throughputs = calc_throughputs(timing_secs)  # dict of secs and throughputs
-    throughput_stats = corestats.Stats(throughputs.values())
-    resp_data_set = [x[1] for x in timings] # grab just the timings
-    response_stats = corestats.Stats(resp_data_set)
+    latency_bins = bin_latencies(aggregator.second_latencies, aggregator.interval)
+    url_stats = get_url_stats(aggregator.url_times)
+    phase_stats = get_phase_stats(aggregator.phase_times)
+    best_times, worst_times = best_and_worst_requests(url_stats)
+    timer_group_stats = get_timer_groups(aggregator.timer_groups)
+    throughputs = calc_throughputs(aggregator.second_counts, aggregator.interval)  # dict of secs and throughputs
+    
+    # the graphs are drawn while the rest of the report is put together
+    print 'Generating Graphs...'
+    graphs = GraphPool([('resp_graph', latency_bins), ('latency_heatmap', latency_bins), ('tp_graph', throughputs)], dir + '/')
+    
+    throughput_stats = series_stats(throughputs.values())
+    response_stats = series_stats(aggregator.latencies)
+    corrected_stats = series_stats(aggregator.corrected_latencies)
     
     # calc the stats and load up a dictionary with the results
-    stats_dict = get_stats(response_stats, throughput_stats)
+    stats_dict = get_stats(response_stats, throughput_stats, corrected_stats)
     
     # get the pickled stats dictionaries we saved
     runtime_stats_dict, workload_dict = load_dat_detail(dir)
@@ -60,11 +80,18 @@ def generate_results(dir, test_name):
     # get the summary stats and load up a dictionary with the results   
     summary_dict = {}
     summary_dict['cur_time'] = time.strftime('%m/%d/%Y %H:%M:%S', time.localtime())
-    summary_dict['duration'] = int(timings[-1][0] - timings[0][0]) + 1  # add 1 to round up
+    summary_dict['duration'] = int(aggregator.last_time - aggregator.first_time) + 1  # add 1 to round up
     summary_dict['num_agents'] = workload_dict['num_agents']
-    summary_dict['req_count'] = len(timing_secs)
-    summary_dict['err_count'] = len(merged_error_log)
-    summary_dict['bytes_received'] = calc_bytes(merged_log)
+    summary_dict['req_count'] = aggregator.count
+    summary_dict['err_count'] = sum([error[3] for error in error_summary])
+    summary_dict['bytes_received'] = aggregator.total_bytes
+    summary_dict['new_connections'] = sum([runtime_stats_dict[id].new_connections for id in runtime_stats_dict])
+    summary_dict['reused_connections'] = sum([runtime_stats_dict[id].reused_connections for id in runtime_stats_dict])
+    summary_dict['dns_hits'] = sum([runtime_stats_dict[id].dns_hits for id in runtime_stats_dict])
+    summary_dict['dns_misses'] = sum([runtime_stats_dict[id].dns_misses for id in runtime_stats_dict])
+    summary_dict['tls_full'] = sum([runtime_stats_dict[id].tls_full for id in runtime_stats_dict])
+    summary_dict['tls_resumed'] = sum([runtime_stats_dict[id].tls_resumed for id in runtime_stats_dict])
+    summary_dict['tls_unknown'] = sum([runtime_stats_dict[id].tls_unknown for id in runtime_stats_dict])
 
     # write html report
     fh = open(dir + '/results.html', 'w')
@@ -73,24 +100,78 @@ def generate_results(dir, test_name):
     reportwriter.write_summary_results(fh, summary_dict, workload_dict)
     reportwriter.write_stats_tables(fh, stats_dict)
     reportwriter.write_images(fh)
+    reportwriter.write_phase_stats(fh, phase_stats)
     reportwriter.write_timer_group_stats(fh, timer_group_stats)
     reportwriter.write_agent_detail_table(fh, runtime_stats_dict)
     reportwriter.write_best_worst_requests(fh, best_times, worst_times)
+    reportwriter.write_url_stats(fh, url_stats)
+    reportwriter.write_error_summary(fh, error_summary)
     reportwriter.write_closing_html(fh)
     fh.close()
     
-    try:  # graphing only works on systems with Matplotlib installed
-        print 'Generating Graphs...'
-        import graph
-        graph.resp_graph(timings, dir=dir+'/')
-        graph.tp_graph(throughputs, dir=dir+'/')
-    except Exception: 
-        sys.stderr.write('ERROR: Unable to generate graphs with Matplotlib\n')
+    for error in graphs.wait():
+        sys.stderr.write('ERROR: %s\n' % error)
     
     print '\nDone generating results. You can view your test at:'
     print '%s/results.html\n' % dir
 
 
+def draw_graph(name, data, dir):
+    # draw one graph with the function of that name in the graph module.  runs in a GraphPool worker process.
+    # returns None, or what went wrong
+    try:
+        import graph
+    except ImportError, e:
+        return 'Unable to generate graphs, can not import the graph module: %s' % e
+    if graph.IMPORT_ERROR is not None:  # graphing only works on systems with Matplotlib installed
+        return 'Unable to generate graphs, Matplotlib is not available: %s' % graph.IMPORT_ERROR
+    try:
+        getattr(graph, name)(data, dir=dir)
+    except Exception, e:
+        return 'Unable to generate %s with Matplotlib: %s' % (name, e)
+    return None
+
+
+def has_raw_results(dir):
+    # were the requests logged one by one (RAW_RESULTS), in the binary columns or agent_stats.csv
+    if resultstore.has_columns(dir):
+        return True
+    csv_path = dir + '/agent_stats.csv'
+    return os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
+
+
+def iter_results(dir):
+    # stream the result rows, from the binary column files if the test wrote them, else from agent_stats.csv
+    if resultstore.has_columns(dir):
+        reader = resultstore.ColumnReader(dir)
+        for row in reader.rows():
+            yield row
+        reader.close()
+        return
+    try:
+        fh = open(dir + '/agent_stats.csv', 'rb')
+    except IOError:
+        sys.stderr.write('ERROR: Can not find your results log file\n')
+        return
+    for line in fh:
+        yield parse_result_line(line)
+    fh.close()
+
+
+def parse_result_line(line):
+    # one agent_stats.csv line, with the same field types as the tuples queued by the agents
+    splat = line.split(',')
+    if len(splat) > 11:
+        corrected_latency = float(splat[11])
+    else:  # logs written before this column existed only have the raw response time
+        corrected_latency = float(splat[8])
+    row = (int(splat[0]), splat[1], splat[2], float(splat[3]), splat[4], int(splat[5]), splat[6],
+        int(splat[7]), float(splat[8]), float(splat[9]), splat[10].strip(), corrected_latency)
+    if len(splat) > 16:  # the phase timings, see core/timing.py
+        row += tuple([float(value) for value in splat[12:17]])
+    return row
+
+
 def load_dat_detail(dir):
     fh = open(dir + '/agent_detail.dat', 'r')
     runtime_stats = pickle.load(fh)
@@ -102,63 +183,70 @@ def load_dat_detail(dir):
         
 
 def merge_error_files(dir):
-    merged_file = []    
-    for filename in glob.glob(dir + r'/*errors.log'):
-        fh = open(filename, 'rb')
-        merged_file += fh.readlines()
-        fh.close()
-    return merged_file
-    
-    
-def list_timings(merged_log):
-    # create a list of tuples with our timing data sorted by second
-    timings = []
-    for line in merged_log:
-        splat = line.split(',')
-        timing_sec = splat[3].strip()
-        response_time = splat[8].strip()
-        timings.append((float(timing_sec), float(response_time)))
-    return sorted(timings)
-    
-    
-def calc_bytes(merged_log):
-    # get total bytes received
-    bytes_seq = []
-    for line in merged_log:
-        bytes = int(line.split(',')[7].strip())
-        bytes_seq.append(bytes)
-    total_bytes = sum(bytes_seq)
-    return total_bytes
-    
-
-def calc_throughputs(timing_secs):
-    # load up a dictionary with secs as keys and counts as values   
-    # need start and end times
-    start_sec = timing_secs[0]
-    end_sec = timing_secs[-1]
-    throughputs = {}
+    # errors of all agents aggregated by (status, reason, url), most frequent first.
+    # returns a list of (status, reason, url, count, first time, last time)
+    error_counts = {}
+    count_files = glob.glob(dir + r'/*error_counts.csv')
+    if count_files:
+        for filename in count_files:
+            fh = open(filename, 'rb')
+            for line in fh:
+                splat = line.rstrip('\r\n').split(',')
+                add_error_count(error_counts, (int(splat[0]), splat[1], splat[2]), int(splat[3]), float(splat[4]), float(splat[5]))
+            fh.close()
+    else:  # results written before the agents kept error counts: one line per error
+        for filename in glob.glob(dir + r'/*errors.log'):
+            fh = open(filename, 'rb')
+            for line in fh:
+                splat = line.rstrip('\r\n').split(',')
+                add_error_count(error_counts, (int(splat[5]), splat[6], splat[4]), 1, float(splat[3]), float(splat[3]))
+            fh.close()
+    error_summary = [key + tuple(counts) for key, counts in error_counts.iteritems()]
+    error_summary.sort(key=lambda error: error[3], reverse=True)
+    return error_summary
+
+
+def add_error_count(error_counts, key, count, first_time, last_time):
+    counts = error_counts.get(key)
+    if counts is None:
+        error_counts[key] = [count, first_time, last_time]
+    else:
+        counts[0] += count
+        counts[1] = min(counts[1], first_time)
+        counts[2] = max(counts[2], last_time)
     
-    # original implementation with no smoothing
-    #for sec in range(start_sec, end_sec + 1):
-    #    count = timing_secs.count(sec)       
-    #    throughputs[sec - start_sec] = count
-    
-    # new implementation with smoothing
-    cur = start_sec - 1
-    step = config.SMOOTH_TP_GRAPH
-    for sec in timing_secs:
-        if sec > cur:
-            cur += step
-        k = cur - start_sec - step + 1
-        v = throughputs.setdefault(k, 0)
-        throughputs[k] += 1
+
+def calc_throughputs(second_counts, interval=1):
+    # load up a dictionary with secs (since the first request) as keys and requests/sec as values.
+    # second_counts holds the requests completed in each interval, keyed by its first sec.
+    # with SMOOTH_TP_GRAPH > interval, counts are averaged over buckets of that many secs (rounded up to whole intervals)
+    start_sec = min(second_counts)
+    step = max(int(math.ceil(float(config.SMOOTH_TP_GRAPH) / interval)), 1) * interval
+    throughputs = {}
+    for sec, count in second_counts.iteritems():
+        k = ((sec - start_sec) // step) * step
+        throughputs[k] = throughputs.get(k, 0) + count
     for k in throughputs:
         throughputs[k] /= float(step)
-        
     return throughputs
     
 
-def get_stats(response_stats, throughput_stats):
+def bin_latencies(second_latencies, interval=1, max_bins=GRAPH_BINS):
+    # merge the response time histograms of each sec (or interval) into at most max_bins time buckets of equal width,
+    # so the graphs cost the same whatever the number of requests.
+    # returns a list of (secs since the first bucket, Histogram), including empty buckets
+    if not second_latencies:
+        return []
+    first_sec = min(second_latencies)
+    span = max(second_latencies) - first_sec + interval
+    width = max(int(math.ceil(float(span) / (interval * max_bins))), 1) * interval
+    bins = [corestats.Histogram() for idx in range(int(math.ceil(float(span) / width)))]
+    for sec, latencies in second_latencies.iteritems():
+        bins[int((sec - first_sec) // width)].merge(latencies)
+    return [(idx * width, latencies) for idx, latencies in enumerate(bins)]
+    
+
+def get_stats(response_stats, throughput_stats, corrected_stats):
     stats_dict = {}
     stats_dict['response_avg'] = response_stats.avg()
     stats_dict['response_stdev'] = response_stats.stdev()
@@ -169,6 +257,9 @@ def get_stats(response_stats, throughput_stats):
     stats_dict['response_90pct'] = response_stats.percentile(90)
     stats_dict['response_95pct'] = response_stats.percentile(95)
     stats_dict['response_99pct'] = response_stats.percentile(99)
+    stats_dict['corrected_90pct'] = corrected_stats.percentile(90)
+    stats_dict['corrected_95pct'] = corrected_stats.percentile(95)
+    stats_dict['corrected_99pct'] = corrected_stats.percentile(99)
     stats_dict['throughput_avg'] = throughput_stats.avg()
     stats_dict['throughput_stdev'] = throughput_stats.stdev()
     stats_dict['throughput_min'] = throughput_stats.min()
@@ -181,17 +272,27 @@ def get_stats(response_stats, throughput_stats):
     return stats_dict 
     
 
-def get_timer_groups(merged_log):  # get the stats by timer group
-    stats_lists = [line.split(',') for line in merged_log]
-    uniq_timer_groups = list(set((stats_list[10].strip() for stats_list in stats_lists)))
+def series_stats(series):
+    # Stats (exact) or Histogram (bounded memory) for a series of values.
+    # with NumPy, exact stats on a float array are cheap enough to use either way
+    if isinstance(series, corestats.Histogram):
+        return series
+    if EXACT_PERCENTILES or corestats.numpy is not None:
+        return corestats.Stats(series)
+    return corestats.Histogram(series)
+    
+
+def new_series():
+    # container for values collected by ResultsAggregator
+    if EXACT_PERCENTILES:
+        return array('d')
+    return corestats.Histogram()
+    
+
+def get_timer_groups(timer_groups):  # get the stats by timer group
     timer_group_stats = {}
-    for timer_group in uniq_timer_groups:
-        elapsed_times = []
-        for stat_list in stats_lists:
-            if timer_group == stat_list[10].strip():
-                if stat_list[5] == '200':  # just concerned with valid responses
-                    elapsed_times.append(stat_list[8])
-        stats = corestats.Stats(elapsed_times)
+    for timer_group, elapsed_times in timer_groups.iteritems():
+        stats = series_stats(elapsed_times)
         stat_group = [
             stats.count(),
             stats.avg(), 
@@ -208,21 +309,48 @@ def get_timer_groups(merged_log):  # get the stats by timer group
     return timer_group_stats
 
     
-def best_and_worst_requests(merged_log):  # get the fastest/slowest urls
-    stats_lists = [line.split(',') for line in merged_log]
-    uniq_urls = list(set((stats_list[4] for stats_list in stats_lists)))
+def get_url_stats(url_times):  # get the stats by url, slowest 99th percentile first
+    url_stats = []
+    for url, elapsed_times in url_times.iteritems():
+        stats = series_stats(elapsed_times)
+        url_stats.append([
+            url,
+            stats.count(),
+            stats.avg(),
+            stats.min(),
+            stats.percentile(50),
+            stats.percentile(90),
+            stats.percentile(95),
+            stats.percentile(99),
+            stats.max()
+        ])
+    url_stats.sort(key=lambda stat_list: stat_list[7], reverse=True)
+    return url_stats
+
+
+def get_phase_stats(phase_times):  # get the stats by request phase (dns, connect, tls, ttfb, transfer), in that order
+    phase_stats = []
+    for phase in timing.PHASES:
+        stats = series_stats(phase_times[phase])
+        if not stats.count():  # results logged before the phases were timed
+            continue
+        phase_stats.append([
+            phase,
+            stats.avg(),
+            stats.min(),
+            stats.percentile(50),
+            stats.percentile(90),
+            stats.percentile(95),
+            stats.percentile(99),
+            stats.max()
+        ])
+    return phase_stats
+
+    
+def best_and_worst_requests(url_stats):  # get the fastest/slowest urls
     url_times = {}
-    for url in uniq_urls:
-        total_time = 0.0
-        elapsed_times = []
-        for stats in stats_lists:
-            if url == stats[4]:
-                if stats[5] == '200':  # just concerned with valid responses
-                    elapsed_times.append(stats[8])
-        for elapsed_time in elapsed_times:
-            total_time += float(elapsed_time)
-            average_time = (total_time / len(elapsed_times))
-            url_times[url] = average_time
+    for stat_list in url_stats:
+        url_times[stat_list[0]] = stat_list[2]  # average response time
     raw_times = sorted(url_times.values())
     best_times = {}
     worst_times = {}
@@ -237,6 +365,216 @@ def best_and_worst_requests(merged_log):  # get the fastest/slowest urls
 
 
 
+class ResultsAggregator:
+    # accumulates everything the report needs from a stream of result rows, in a single pass.
+    # per-second and per-group state is kept in dicts, response times in histograms
+    # (or, with EXACT_PERCENTILES, in float arrays)
+    def __init__(self):
+        self.count = 0
+        self.total_bytes = 0
+        self.first_time = None
+        self.last_time = None
+        self.interval = 1  # secs covered by each second_counts entry
+        self.second_counts = {}  # int epoch sec -> requests completed in it
+        self.second_latencies = {}  # int epoch sec -> Histogram of its response times, for the graphs
+        self.latencies = new_series()
+        self.corrected_latencies = new_series()
+        if EXACT_PERCENTILES:
+            self.add_latency = self.latencies.append
+            self.add_corrected_latency = self.corrected_latencies.append
+        else:
+            self.add_latency = self.latencies.record
+            self.add_corrected_latency = self.corrected_latencies.record
+        self.timer_groups = {}  # timer group -> response times of valid (200) responses
+        self.url_times = {}  # url -> response times of valid (200) responses
+        self.phase_times = dict([(phase, new_series()) for phase in timing.PHASES])  # phase -> times of all responses
+        if EXACT_PERCENTILES:
+            self.add_phases = [self.phase_times[phase].append for phase in timing.PHASES]
+        else:
+            self.add_phases = [self.phase_times[phase].record for phase in timing.PHASES]
+        
+    def add(self, row):
+        end_time = row[3]
+        latency = row[8]
+        self.count += 1
+        self.total_bytes += row[7]
+        if self.first_time is None or end_time < self.first_time:
+            self.first_time = end_time
+        if self.last_time is None or end_time > self.last_time:
+            self.last_time = end_time
+        sec = int(end_time)
+        self.second_counts[sec] = self.second_counts.get(sec, 0) + 1
+        sec_times = self.second_latencies.get(sec)
+        if sec_times is None:
+            sec_times = self.second_latencies[sec] = corestats.Histogram()
+        sec_times.record(latency)
+        self.add_latency(latency)
+        self.add_corrected_latency(row[11])
+        if len(row) > 12:
+            for add_phase, phase_time in zip(self.add_phases, row[12:]):
+                add_phase(phase_time)
+        
+        # one hash lookup per row and group, whatever the number of groups
+        group_times = self.timer_groups.get(row[10])
+        if group_times is None:
+            group_times = self.timer_groups[row[10]] = new_series()
+        if row[5] == 200:  # just concerned with valid responses
+            url_times = self.url_times.get(row[4])
+            if url_times is None:
+                url_times = self.url_times[row[4]] = new_series()
+            if EXACT_PERCENTILES:
+                group_times.append(latency)
+                url_times.append(latency)
+            else:
+                group_times.record(latency)
+                url_times.record(latency)
+
+
+
+
+class ColumnAggregator:
+    # the same results as a ResultsAggregator fed every row, computed with NumPy straight from the binary columns
+    def __init__(self, reader):
+        np = corestats.numpy
+        self.reader = reader  # the arrays below are views of its memory maps
+        self.end_times = reader.numpy_column('end_time')
+        self.latencies = reader.numpy_column('latency')
+        self.corrected_latencies = reader.numpy_column('corrected_latency')
+        self.count = len(self.end_times)
+        self.total_bytes = int(reader.numpy_column('bytes').sum())
+        self.first_time = None
+        self.last_time = None
+        self.interval = 1
+        self.second_counts = {}
+        self.second_latencies = {}
+        self.timer_groups = {}
+        self.url_times = {}
+        if reader.has_phases():
+            self.phase_times = dict([(phase, reader.numpy_column(phase)) for phase in timing.PHASES])
+        else:
+            self.phase_times = dict([(phase, np.zeros(0)) for phase in timing.PHASES])
+        if not self.count:
+            return
+        self.first_time = float(self.end_times.min())
+        self.last_time = float(self.end_times.max())
+        
+        secs = self.end_times.astype(np.int64)
+        first_sec = secs.min()
+        counts = np.bincount(secs - first_sec)
+        by_sec = self.latencies[np.argsort(secs, kind='mergesort')]
+        ends = np.cumsum(counts)
+        for offset in np.flatnonzero(counts):
+            sec = int(first_sec + offset)
+            self.second_counts[sec] = int(counts[offset])
+            self.second_latencies[sec] = corestats.Histogram()
+            self.second_latencies[sec].record_array(by_sec[ends[offset] - counts[offset]:ends[offset]])
+        
+        valid = reader.numpy_column('status') == 200  # just concerned with valid responses
+        valid_latencies = self.latencies[valid]
+        self.timer_groups = self.group_by(reader, 'timer_group', valid, valid_latencies)
+        self.url_times = self.group_by(reader, 'url', valid, valid_latencies)
+        for url, elapsed_times in self.url_times.items():
+            if not len(elapsed_times):
+                del self.url_times[url]  # like ResultsAggregator, only urls with valid responses
+                
+    def group_by(self, reader, column, valid, valid_latencies):
+        # sort the valid response times by dictionary id, then slice each group out
+        np = corestats.numpy
+        names = reader.dictionaries[column]
+        ids = reader.numpy_column(column)[valid].astype(np.intp)
+        grouped = valid_latencies[np.argsort(ids, kind='mergesort')]
+        ends = np.cumsum(np.bincount(ids, minlength=len(names)))
+        groups = {}
+        start = 0
+        for id, end in enumerate(ends):
+            groups[names[id]] = grouped[start:end]
+            start = end
+        return groups
+
+
+
+
+class RollupAggregator:
+    # the same results from the rollups written during the test, in O(intervals) instead of O(requests).
+    # response times come from the rollup histograms
+    def __init__(self, reader):
+        self.interval = reader.interval
+        self.count = 0
+        self.total_bytes = 0
+        self.first_time = None
+        self.last_time = None
+        self.second_counts = {}  # first sec of the interval -> requests completed in it
+        self.second_latencies = {}  # first sec of the interval -> Histogram of its response times
+        self.latencies = corestats.Histogram()
+        self.corrected_latencies = corestats.Histogram()
+        self.timer_groups = {}
+        self.url_times = reader.url_times
+        self.phase_times = dict([(phase, corestats.Histogram()) for phase in timing.PHASES])
+        for start in reader.starts():
+            interval_count = 0
+            interval_latencies = corestats.Histogram()
+            for group, rollup in reader.rollups[start].iteritems():
+                interval_count += rollup.count
+                self.total_bytes += rollup.bytes
+                if self.first_time is None or rollup.first_time < self.first_time:
+                    self.first_time = rollup.first_time
+                if self.last_time is None or rollup.last_time > self.last_time:
+                    self.last_time = rollup.last_time
+                interval_latencies.merge(rollup.latencies())
+                self.corrected_latencies.merge(rollup.corrected_times)
+                for phase, times in rollup.phase_times.iteritems():
+                    self.phase_times[phase].merge(times)
+                group_times = self.timer_groups.get(group)
+                if group_times is None:
+                    group_times = self.timer_groups[group] = corestats.Histogram()
+                group_times.merge(rollup.valid_times)
+            if interval_count:
+                self.count += interval_count
+                self.second_counts[start] = interval_count
+                self.second_latencies[start] = interval_latencies
+                self.latencies.merge(interval_latencies)
+
+
+
+
+class GraphPool:
+    # draws (graph function name, data) pairs in worker processes.  Matplotlib is never imported by the process
+    # generating load, and the graphs render in parallel with the html report
+    def __init__(self, graphs, dir):
+        self.pool = None
+        self.pending = []
+        self.errors = []
+        if GRAPH_PROCESSES > 0 and not sys.platform.startswith('win'):
+            try:
+                import multiprocessing
+                self.pool = multiprocessing.Pool(min(GRAPH_PROCESSES, len(graphs)))
+            except (ImportError, OSError), e:
+                sys.stderr.write('WARNING: Unable to start graph processes, drawing the graphs in this one: %s\n' % e)
+        if self.pool is not None:
+            self.pending = [self.pool.apply_async(draw_graph, (name, data, dir)) for name, data in graphs]
+            self.pool.close()
+        else:  # no worker processes (or no fork on windows): draw them here, one after the other
+            self.errors = [draw_graph(name, data, dir) for name, data in graphs]
+            
+    def wait(self):
+        # wait for every graph to be drawn.  returns the errors, each reported once
+        errors = list(self.errors)
+        for result in self.pending:
+            try:
+                errors.append(result.get())
+            except Exception, e:  # the worker itself failed
+                errors.append('Unable to generate graphs: %s' % e)
+        if self.pool is not None:
+            self.pool.join()
+        unique_errors = []
+        for error in errors:
+            if error and error not in unique_errors:
+                unique_errors.append(error)
+        return unique_errors
+
+
+
+
 class ResultsGenerator(Thread):  # generate results in a new thread so UI isn't blocked
     def __init__(self, dir, test_name):
         Thread.__init__(self)
@@ -0,0 +1,403 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Binary columnar results.  With RESULTS_FORMAT = 'binary' (or 'both'), the
+#  ResultWriter stores each field of the result rows in its own file of
+#  fixed-width values under <output dir>/columns/.  URLs, status messages and
+#  timer groups are stored once in a dictionary and referenced by integer id.
+#  The column files are memory-mapped for reading, so a report can be built
+#  from them without parsing text or holding the whole log in memory.
+#
+#  Rollups.  With ROLLUP_INTERVAL > 0, the ResultWriter also sums the rows up
+#  per interval (1 sec by default) and timer group: request, error and byte
+#  counts and histograms of the response times.  Each interval is appended to
+#  <output dir>/rollups.dat once it closes, so a report can be built in
+#  O(seconds) instead of O(requests), even with per-request logging turned off.
+
+
+import mmap
+import os
+import pickle
+import struct
+from array import array
+from corestats import Histogram
+from timing import PHASES
+
+
+
+COLUMNS_DIR = 'columns'
+INDEX_FILE = 'columns.dat'  # pickled column layout, dictionaries and row count
+# (name, array typecode, field of the result row tuple queued by the agents)
+COLUMNS = (
+    ('agent', 'I', 0),
+    ('end_time', 'd', 3),
+    ('url', 'I', 4),
+    ('status', 'H', 5),
+    ('msg', 'I', 6),
+    ('bytes', 'd', 7),  # python 2's array has no 8 byte int, and 'L' is 4 bytes on windows.  exact up to 2**53
+    ('latency', 'd', 8),
+    ('connect_latency', 'd', 9),
+    ('timer_group', 'I', 10),
+    ('corrected_latency', 'd', 11),
+    ('dns', 'd', 12),
+    ('connect', 'd', 13),
+    ('tls', 'd', 14),
+    ('ttfb', 'd', 15),
+    ('transfer', 'd', 16),
+)
+ENCODED = ('url', 'msg', 'timer_group')  # columns holding dictionary ids
+READ_CHUNK_ROWS = 65536  # rows decoded at a time by ColumnReader.rows()
+ROLLUP_FILE = 'rollups.dat'  # stream of pickled records, see RollupWriter
+ROLLUP_GRACE = 2  # secs.  an interval is written once rows this much newer than its end have arrived
+
+
+
+def has_columns(dir):
+    return os.path.exists(os.path.join(dir, COLUMNS_DIR, INDEX_FILE))
+
+
+def has_rollups(dir):
+    return os.path.exists(os.path.join(dir, ROLLUP_FILE))
+
+
+def read_rollup_records(path):
+    # the records of a rollup file, in order
+    fh = open(path, 'rb')
+    try:
+        while True:
+            try:
+                yield pickle.load(fh)
+            except EOFError:  # the end of the file
+                break
+            except (pickle.UnpicklingError, ValueError, IndexError, KeyError, TypeError, struct.error):
+                break  # the last record of a test that was killed while writing it
+    finally:
+        fh.close()
+
+
+def histogram_state(histogram):
+    # plain data, so the rollup file doesn't depend on how the corestats module was imported
+    return (histogram.counts, histogram.total_count, histogram.total, histogram.total_squares,
+        histogram.min_value, histogram.max_value)
+
+
+def histogram_from_state(state):
+    histogram = Histogram()
+    (histogram.counts, histogram.total_count, histogram.total, histogram.total_squares,
+        histogram.min_value, histogram.max_value) = state
+    return histogram
+
+
+
+
+class Dictionary:
+    # maps strings to small integer ids, in order of first appearance
+    def __init__(self, values=None):
+        self.values = values or []
+        self.ids = dict([(value, id) for id, value in enumerate(self.values)])
+
+    def encode(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            id = len(self.values)
+            self.ids[value] = id
+            self.values.append(value)
+        return id
+
+
+
+
+class ColumnWriter:
+    # appends batches of result rows (the tuples queued by the agents) to the column files
+    def __init__(self, output_dir):
+        self.dir = os.path.join(output_dir, COLUMNS_DIR)
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        self.files = [open(os.path.join(self.dir, name + '.col'), 'wb') for name, typecode, field in COLUMNS]
+        self.dictionaries = dict([(name, Dictionary()) for name in ENCODED])
+        self.row_count = 0
+        self.write_index()
+
+    def write(self, rows):
+        if not rows:
+            return
+        fields = zip(*rows)
+        for (name, typecode, field), fh in zip(COLUMNS, self.files):
+            values = fields[field]
+            if name in self.dictionaries:
+                encode = self.dictionaries[name].encode
+                values = [encode(value) for value in values]
+            array(typecode, values).tofile(fh)
+        self.row_count += len(rows)
+
+    def flush(self):
+        for fh in self.files:
+            fh.flush()
+        self.write_index()
+
+    def close(self):
+        for fh in self.files:
+            fh.close()
+        self.write_index()
+
+    def write_index(self):
+        # written to a temp file and renamed into place, so a reader never sees half of it
+        index = {
+            'columns': [(name, typecode, array(typecode).itemsize) for name, typecode, field in COLUMNS],
+            'dictionaries': dict([(name, self.dictionaries[name].values) for name in ENCODED]),
+            'row_count': self.row_count,
+        }
+        path = os.path.join(self.dir, INDEX_FILE)
+        fh = open(path + '.tmp', 'wb')
+        pickle.dump(index, fh, pickle.HIGHEST_PROTOCOL)
+        fh.close()
+        if os.path.exists(path):
+            os.remove(path)  # rename can't replace an existing file on Windows
+        os.rename(path + '.tmp', path)
+
+
+
+
+class ColumnReader:
+    # memory-mapped access to the column files written by ColumnWriter
+    def __init__(self, output_dir):
+        self.dir = os.path.join(output_dir, COLUMNS_DIR)
+        fh = open(os.path.join(self.dir, INDEX_FILE), 'rb')
+        index = pickle.load(fh)
+        fh.close()
+        self.dictionaries = index['dictionaries']
+        self.layout = {}
+        self.maps = {}
+        self.row_count = index['row_count']
+        for name, typecode, itemsize in index['columns']:
+            if array(typecode).itemsize != itemsize:
+                raise ValueError('column %s was written on a platform with a different %r size' % (name, typecode))
+            self.layout[name] = (typecode, itemsize)
+            fh = open(os.path.join(self.dir, name + '.col'), 'rb')
+            size = os.fstat(fh.fileno()).st_size
+            if size:
+                self.maps[name] = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.maps[name] = ''  # an empty file can't be mapped
+            fh.close()
+            self.row_count = min(self.row_count, size / itemsize)
+
+    def __len__(self):
+        return self.row_count
+
+    def column(self, name, start=0, stop=None):
+        # values of one column for rows start to stop, as an array
+        typecode, itemsize = self.layout[name]
+        if stop is None or stop > self.row_count:
+            stop = self.row_count
+        values = array(typecode)
+        values.fromstring(self.maps[name][start * itemsize:stop * itemsize])
+        return values
+
+    def numpy_column(self, name):
+        # a whole column as a NumPy array over the memory map, without copying it.
+        # the array keeps the map alive, so don't close() the reader while it is in use
+        import numpy
+        typecode, itemsize = self.layout[name]
+        if not self.row_count:
+            return numpy.zeros(0, numpy.dtype(typecode))
+        return numpy.frombuffer(self.maps[name], numpy.dtype(typecode), self.row_count)
+
+    def has_phases(self):
+        # columns written before the phase timings existed don't have them
+        return PHASES[0] in self.layout
+
+    def rows(self, chunk_rows=READ_CHUNK_ROWS):
+        # yield the rows in the same layout as the agent_stats.csv fields, decoded a chunk at a time.
+        # the date and time strings are not stored, so those two fields are empty
+        urls = self.dictionaries['url']
+        msgs = self.dictionaries['msg']
+        timer_groups = self.dictionaries['timer_group']
+        has_phases = self.has_phases()
+        for start in xrange(0, self.row_count, chunk_rows):
+            stop = start + chunk_rows
+            columns = zip(self.column('agent', start, stop), self.column('end_time', start, stop),
+                self.column('url', start, stop), self.column('status', start, stop), self.column('msg', start, stop),
+                self.column('bytes', start, stop), self.column('latency', start, stop), self.column('connect_latency', start, stop),
+                self.column('timer_group', start, stop), self.column('corrected_latency', start, stop))
+            if has_phases:
+                phases = zip(*[self.column(phase, start, stop) for phase in PHASES])
+            for i, (agent, end_time, url, status, msg, bytes, latency, connect_latency, timer_group, corrected_latency) in enumerate(columns):
+                row = (int(agent), '', '', end_time, urls[url], status, msgs[msg], int(bytes), latency, connect_latency,
+                    timer_groups[timer_group], corrected_latency)
+                if has_phases:
+                    row += phases[i]
+                yield row
+
+    def close(self):
+        for mapped in self.maps.values():
+            if mapped:
+                mapped.close()
+        self.maps = {}
+
+
+
+
+
+class GroupRollup:
+    # totals of one timer group over one interval
+    def __init__(self):
+        self.count = 0
+        self.errors = 0  # responses other than 200
+        self.bytes = 0
+        self.first_time = None  # end times of the first and last requests
+        self.last_time = None
+        self.valid_times = Histogram()  # response times of valid (200) responses
+        self.error_times = Histogram()  # response times of the others
+        self.corrected_times = Histogram()  # corrected response times of all responses
+        self.phase_times = dict([(phase, Histogram()) for phase in PHASES])  # phase name -> times of all responses
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        if self.first_time is None or (other.first_time is not None and other.first_time < self.first_time):
+            self.first_time = other.first_time
+        if self.last_time is None or (other.last_time is not None and other.last_time > self.last_time):
+            self.last_time = other.last_time
+        self.valid_times.merge(other.valid_times)
+        self.error_times.merge(other.error_times)
+        self.corrected_times.merge(other.corrected_times)
+        for phase in PHASES:
+            self.phase_times[phase].merge(other.phase_times[phase])
+
+    def latencies(self):
+        # response times of all responses
+        latencies = self.valid_times.copy()
+        latencies.merge(self.error_times)
+        return latencies
+
+    def state(self):
+        return (self.count, self.errors, self.bytes, self.first_time, self.last_time,
+            histogram_state(self.valid_times), histogram_state(self.error_times), histogram_state(self.corrected_times),
+            dict([(phase, histogram_state(times)) for phase, times in self.phase_times.iteritems()]))
+
+    def from_state(cls, state):
+        rollup = cls()
+        rollup.count, rollup.errors, rollup.bytes, rollup.first_time, rollup.last_time = state[:5]
+        rollup.valid_times, rollup.error_times, rollup.corrected_times = [histogram_from_state(hist_state) for hist_state in state[5:8]]
+        if len(state) > 8:  # rollups written before the phase timings existed don't have them
+            for phase, hist_state in state[8].iteritems():
+                rollup.phase_times[phase] = histogram_from_state(hist_state)
+        return rollup
+    from_state = classmethod(from_state)
+
+
+
+
+class RollupWriter:
+    # sums result rows (the tuples queued by the agents) up per interval and timer group.
+    # records appended to the rollup file:
+    #   ('interval', secs)                       first, the length of an interval
+    #   ('rollup', start, {timer group: state})  one per closed interval.  rows that arrive after their
+    #                                            interval was written go in a later record for the same start
+    #   ('urls', {url: state})                   last, response times of valid responses per url for the whole test
+    # the files of several tests (the nodes of a distributed test) can be joined into one, see core/distributed.py
+    def __init__(self, output_dir, interval):
+        self.interval = interval
+        self.fh = open(os.path.join(output_dir, ROLLUP_FILE), 'wb')
+        self.open_rollups = {}  # interval start -> {timer group: GroupRollup}
+        self.url_times = {}  # url -> Histogram of valid response times
+        self.newest_time = None
+        self.dump(('interval', interval))
+
+    def dump(self, record):
+        pickle.dump(record, self.fh, pickle.HIGHEST_PROTOCOL)
+
+    def write(self, rows):
+        interval = self.interval
+        open_rollups = self.open_rollups
+        for row in rows:
+            end_time = row[3]
+            start = int(end_time // interval) * interval
+            groups = open_rollups.get(start)
+            if groups is None:
+                groups = open_rollups[start] = {}
+            rollup = groups.get(row[10])
+            if rollup is None:
+                rollup = groups[row[10]] = GroupRollup()
+            rollup.count += 1
+            rollup.bytes += row[7]
+            if rollup.first_time is None or end_time < rollup.first_time:
+                rollup.first_time = end_time
+            if rollup.last_time is None or end_time > rollup.last_time:
+                rollup.last_time = end_time
+            if row[5] == 200:
+                rollup.valid_times.record(row[8])
+                url_times = self.url_times.get(row[4])
+                if url_times is None:
+                    url_times = self.url_times[row[4]] = Histogram()
+                url_times.record(row[8])
+            else:
+                rollup.errors += 1
+                rollup.error_times.record(row[8])
+            rollup.corrected_times.record(row[11])
+            if len(row) > 12:
+                phase_times = rollup.phase_times
+                for i, phase in enumerate(PHASES):
+                    phase_times[phase].record(row[12 + i])
+            if self.newest_time is None or end_time > self.newest_time:
+                self.newest_time = end_time
+        self.write_closed()
+
+    def write_closed(self, all=False):
+        # write the intervals no more rows are expected for (or all of them)
+        for start in sorted(self.open_rollups):
+            if not all and start + self.interval + ROLLUP_GRACE > self.newest_time:
+                break
+            groups = self.open_rollups.pop(start)
+            self.dump(('rollup', start, dict([(group, rollup.state()) for group, rollup in groups.iteritems()])))
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        self.write_closed(all=True)
+        self.dump(('urls', dict([(url, histogram_state(times)) for url, times in self.url_times.iteritems()])))
+        self.fh.close()
+
+
+
+
+class RollupReader:
+    # the rollup file, with the records of each interval (and the url records) merged
+    def __init__(self, output_dir):
+        self.interval = 1
+        self.rollups = {}  # interval start -> {timer group: GroupRollup}
+        self.url_times = {}  # url -> Histogram of valid response times
+        for record in read_rollup_records(os.path.join(output_dir, ROLLUP_FILE)):
+            if record[0] == 'interval':
+                self.interval = record[1]
+            elif record[0] == 'rollup':
+                groups = self.rollups.setdefault(record[1], {})
+                for group, state in record[2].iteritems():
+                    rollup = GroupRollup.from_state(state)
+                    if group in groups:
+                        groups[group].merge(rollup)
+                    else:
+                        groups[group] = rollup
+            elif record[0] == 'urls':
+                for url, state in record[1].iteritems():
+                    times = histogram_from_state(state)
+                    if url in self.url_times:
+                        self.url_times[url].merge(times)
+                    else:
+                        self.url_times[url] = times
+
+    def starts(self):
+        return sorted(self.rollups)
@@ -0,0 +1,143 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Open workload model.  With ARRIVAL_RATE > 0, requests are not paced by each
+#  agent (send, wait for the response, sleep the rest of the interval).  Instead
+#  a scheduler dispatches requests at the target rate to whichever agent is free,
+#  whether or not earlier requests have completed.  When every agent is busy the
+#  dispatch is dropped and counted, so a slow server can no longer hide behind a
+#  falling request rate.
+
+
+import Queue
+import random
+import time
+from threading import Thread
+import config
+from engine import LoadAgent
+
+
+
+SHUFFLE_TESTCASES = config.SHUFFLE_TESTCASES  # default is False
+ARRIVAL_POISSON = config.ARRIVAL_POISSON  # default is False
+LATE_DISPATCH = config.LATE_DISPATCH  # secs
+
+
+
+class ArrivalSchedule:
+    # the intended send time of every request is fixed by the arrival rate up front
+    def __init__(self, rate, msg_queue):
+        self.rate = float(rate)
+        self.plan = [req for req in msg_queue for repeat in range(req.repeat)]
+        self.plan_idx = 0
+        self.next_time = float('inf')  # nothing is due until start()
+        self.dispatched = 0
+        self.dropped = 0  # no free agent at the intended time
+        self.late = 0  # sent more than LATE_DISPATCH secs after the intended time
+
+
+    def start(self):
+        # called once every agent has been started, so the rampup isn't counted as dropped dispatches
+        self.next_time = time.time()
+
+
+    def next_request(self):
+        if SHUFFLE_TESTCASES:
+            return random.choice(self.plan)
+        req = self.plan[self.plan_idx]
+        self.plan_idx = (self.plan_idx + 1) % len(self.plan)
+        return req
+
+
+    def run_due(self, now, dispatch):
+        # dispatch every arrival that is due.
+        # dispatch(req, intended_time) returns False when no agent is free to take it
+        if not self.plan:
+            return
+        while self.next_time <= now:
+            if dispatch(self.next_request(), self.next_time):
+                self.dispatched += 1
+                if (now - self.next_time) > LATE_DISPATCH:
+                    self.late += 1
+            else:
+                self.dropped += 1  # not late as well, it was never sent
+            if ARRIVAL_POISSON:
+                self.next_time += random.expovariate(self.rate)
+            else:
+                self.next_time += 1.0 / self.rate
+
+
+    def counts(self):
+        return (self.dispatched, self.dropped, self.late)
+
+
+
+
+class ArrivalScheduler(Thread):
+    # drives an ArrivalSchedule for threaded agents
+    def __init__(self, schedule, dispatch):
+        Thread.__init__(self)
+        self.running = True
+        self.schedule = schedule
+        self.dispatch = dispatch
+
+
+    def run(self):
+        while self.running:
+            self.schedule.run_due(time.time(), self.dispatch)
+            delay = self.schedule.next_time - time.time()
+            if delay > 0:
+                time.sleep(min(delay, 0.1))
+
+
+    def stop(self):
+        self.running = False
+
+
+
+
+class DispatchedAgent(LoadAgent):
+    # a threaded agent that waits for the scheduler to hand it requests instead of pacing itself
+    def __init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, idle_agents, trace_writer=None):
+        LoadAgent.__init__(self, id, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, trace_writer)
+        self.idle_agents = idle_agents  # shared queue of agents ready for work
+        self.inbox = Queue.Queue()  # (req, intended time), or None from stop()
+
+
+    def assign(self, req, intended_time):
+        self.inbox.put((req, intended_time))
+
+
+    def stop(self):
+        LoadAgent.stop(self)
+        self.inbox.put(None)  # wake run() up
+
+
+    def run(self):
+        self.mark_started()
+
+        self.idle_agents.put(self)
+        while self.running:
+            assignment = self.inbox.get()  # no timeout: python 2 polls for those, which would delay every request
+            if assignment is None:
+                break
+            req, intended_time = assignment
+            self.context.new_pass()  # every arrival is a new visitor, the requests of a pass go to any agent
+            intended_start = intended_time - time.time() + self.default_timer()  # schedule runs on wall clock time
+            resp, content, req_start_time, req_end_time, connect_end_time, resp_bytes = self.send(req)
+            self.record(req, resp, content, req_start_time, req_end_time, connect_end_time, intended_start, resp_bytes)
+            self.idle_agents.put(self)
+
+        if self.conn_pool:
+            self.conn_pool.close()
+        self.close_error_log()
@@ -0,0 +1,157 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Multi-process agent sharding.  With WORKER_PROCESSES > 1, LoadManager forks
+#  worker processes and hands agent N to worker (N % WORKER_PROCESSES).  Each
+#  worker runs an ordinary AgentGroup and periodically ships its stats, errors
+#  and result rows back to the parent, which feeds them into the same shared
+#  runtime_stats/error_queue/results_queue a single-process run uses.
+#  Agents in the workers write their error and trace logs straight into the
+#  shared output directory, so the results layout does not change.
+
+
+import multiprocessing
+import Queue
+import signal
+import sys
+import time
+from threading import Lock, Thread
+from engine import AgentGroup, ErrorQueue, ResultsQueue, snapshot_stats
+
+
+
+FLUSH_INTERVAL = 0.25  # secs between updates sent from a worker to the parent
+
+
+
+class ShardPool:
+    # parent side.  looks like an AgentGroup to LoadManager (add_agent/start_schedule/stop)
+    def __init__(self, num_workers, interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, arrival_rate=0):
+        self.runtime_stats = runtime_stats
+        self.error_queue = error_queue
+        self.results_queue = results_queue
+
+        self.updates = multiprocessing.Queue()  # (worker_id, stats, errors, rows, dispatch_counts, is_done) from all workers
+        self.worker_dispatch_counts = [(0, 0, 0)] * num_workers
+        self.lock = Lock()  # add_agent and stop are called from different threads
+        self.workers = []
+        for worker_id in range(num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker_main,
+                args=(worker_id, child_conn, self.updates, interval, log_msgs, output_dir, msg_queue, float(arrival_rate) / num_workers))
+            process.daemon = True
+            process.start()
+            self.workers.append((process, parent_conn))
+
+        self.collector = Thread(target=self.collect)
+        self.collector.setDaemon(True)
+        self.collector.start()
+
+
+    def add_agent(self, id):
+        process, conn = self.workers[id % len(self.workers)]
+        self.lock.acquire()
+        try:
+            conn.send(('start', id))
+        finally:
+            self.lock.release()
+
+
+    def start_schedule(self):
+        self.lock.acquire()
+        try:
+            for process, conn in self.workers:
+                conn.send(('start_schedule',))
+        finally:
+            self.lock.release()
+
+
+    def stop(self):
+        # workers stop their agents (waiting for them if configured), send a final update and exit
+        self.lock.acquire()
+        try:
+            for process, conn in self.workers:
+                conn.send(('stop',))
+        finally:
+            self.lock.release()
+        while self.collector.isAlive():
+            self.collector.join(0.1)
+        for process, conn in self.workers:
+            process.join()
+
+
+    def dispatch_counts(self):
+        # (dispatched, dropped, late) for the open model, summed over the workers
+        return tuple([sum(counts) for counts in zip(*self.worker_dispatch_counts)])
+
+
+    def collect(self):
+        remaining = len(self.workers)
+        while remaining:
+            try:
+                worker_id, stats, errors, rows, dispatch_counts, is_done = self.updates.get(True, 1)
+            except Queue.Empty:
+                if not [process for process, conn in self.workers if process.is_alive()]:
+                    sys.stderr.write('ERROR: Worker processes exited before sending their results\n')
+                    return
+                continue
+            self.runtime_stats.update(stats)
+            self.error_queue.extend(errors)
+            for row in rows:
+                self.results_queue.add(row)
+            self.worker_dispatch_counts[worker_id] = dispatch_counts
+            if is_done:
+                remaining -= 1
+
+
+
+
+def worker_main(worker_id, commands, updates, interval, log_msgs, output_dir, msg_queue, arrival_rate):
+    # entry point of a worker process.  with the open model, each worker takes an equal share of the arrival rate
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # ctrl-c is handled by the parent, which stops us
+
+    runtime_stats = {}
+    error_queue = ErrorQueue()
+    results_queue = ResultsQueue()  # unbounded, the parent's queue applies RESULTS_QUEUE_FULL
+    agents = AgentGroup(interval, log_msgs, output_dir, runtime_stats, error_queue, msg_queue, results_queue, arrival_rate)
+
+    running = True
+    next_flush = time.time() + FLUSH_INTERVAL
+    while running:
+        if commands.poll(FLUSH_INTERVAL):
+            command = commands.recv()
+            if command[0] == 'start':
+                agents.add_agent(command[1])
+            elif command[0] == 'start_schedule':
+                agents.start_schedule()
+            elif command[0] == 'stop':
+                agents.stop()
+                running = False
+        if running and time.time() >= next_flush:
+            send_update(worker_id, updates, agents, runtime_stats, error_queue, results_queue, False)
+            next_flush = time.time() + FLUSH_INTERVAL
+    send_update(worker_id, updates, agents, runtime_stats, error_queue, results_queue, True)
+    updates.close()
+    updates.join_thread()  # make sure the last update is flushed to the pipe before exiting
+
+
+def send_update(worker_id, updates, agents, runtime_stats, error_queue, results_queue, is_done):
+    rows = []
+    while True:
+        try:
+            rows.append(results_queue.get(False))
+        except Queue.Empty:
+            break
+    errors = error_queue.drain()
+    stats = snapshot_stats(runtime_stats)
+    updates.put((worker_id, stats, errors, rows, agents.dispatch_counts(), is_done))
@@ -0,0 +1,112 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  Request timing.  Agents time requests with a monotonic clock, so a system
+#  clock adjustment during a test can't make response times negative or huge.
+#  Python 2 has no time.monotonic, so clock_gettime(CLOCK_MONOTONIC) is called
+#  through ctypes where the C library has it.  Each request is split into
+#  phases: name resolution, TCP connect, TLS handshake, time to first byte
+#  (sending the request and waiting for the response headers) and the transfer
+#  of the body.
+
+
+import ctypes
+import ctypes.util
+import sys
+import time
+
+
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')  # order of the phase fields in the result rows
+CLOCK_MONOTONIC = {'linux': 1, 'darwin': 6, 'freebsd': 4}  # clock id per platform (sys.platform prefix)
+
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def monotonic_timer():
+    # a function returning secs on a monotonic clock, or None if there is none we can call
+    clock_id = None
+    for prefix, id in CLOCK_MONOTONIC.items():
+        if sys.platform.startswith(prefix):
+            clock_id = id
+    if clock_id is None:
+        return None
+    for name in ('c', 'rt'):  # older glibc keeps clock_gettime in librt
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def timer():
+            ts = timespec()  # one per call, agent threads read the clock concurrently
+            clock_gettime(clock_id, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        if timer() > 0:
+            return timer
+    return None
+
+
+if sys.platform.startswith('win'):
+    timer = time.clock  # time.clock() is a monotonic, high resolution counter on Windows
+else:
+    timer = monotonic_timer() or time.time
+
+
+
+
+class Phases:
+    # connection setup times of the request in flight, added up over every connection it opened
+    # (redirects and retries).  a request on a reused keep-alive connection has no setup time.
+    # connections counts the connections it opened, dns_hits and dns_misses its host name lookups that
+    # were (not) answered by the dnscache, tls_full, tls_resumed and tls_unknown its TLS handshakes
+    # (tls_unknown when pyOpenSSL can't tell whether the session was resumed)
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.connections = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.tls_full = 0
+        self.tls_resumed = 0
+        self.tls_unknown = 0
+
+    def count_handshake(self, is_resumed):
+        if is_resumed is None:
+            self.tls_unknown += 1
+        elif is_resumed:
+            self.tls_resumed += 1
+        else:
+            self.tls_full += 1
+
+    def count_lookup(self, is_hit):
+        if is_hit:
+            self.dns_hits += 1
+        else:
+            self.dns_misses += 1
+
+    def split(self, start, headers, end):
+        # (dns, connect, tls, ttfb, transfer) of a request sent at start, with response headers at headers
+        # and the body read at end (timer() times).  ttfb is what is left until the headers after the setup
+        setup = self.dns + self.connect + self.tls
+        return (self.dns, self.connect, self.tls, max(headers - start - setup, 0.0), max(end - headers, 0.0))
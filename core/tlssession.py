@@ -0,0 +1,283 @@
+#
+#    Copyright (c) 2007-2009 Corey Goldberg (corey@goldb.org)
+#    License: GNU GPLv3
+#
+#    This file is part of Pylot.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.  See the GNU General Public License
+#    for more details.
+#
+
+#  TLS for the agents' connections.  Real clients resume their TLS session
+#  when they reconnect, which skips most of the handshake.  Python 2's ssl
+#  module can't hand a session from one connection to the next, so when
+#  TLS_SESSION_CACHE is turned on the handshakes are done with pyOpenSSL (it
+#  must be installed) and each agent keeps the last session of every host:port
+#  in a SessionCache.  TLSSocket makes a pyOpenSSL connection look like an
+#  ssl.SSLSocket, for httplib and for the event engine's non-blocking
+#  sockets.  Otherwise the ssl module does every handshake, a full one, as
+#  before.  TLS_CA_FILE trusts a test server's self-signed certificate.
+
+
+import re
+import select
+import socket
+import ssl
+import sys
+import config
+
+try:
+    import OpenSSL.SSL  # TLS session resumption.  Only used on systems that have it installed.
+except ImportError:
+    OpenSSL = None
+
+
+
+TLS_SESSION_CACHE = config.TLS_SESSION_CACHE  # default is False
+TLS_CA_FILE = config.TLS_CA_FILE  # default is None (the system's CA certificates)
+SEND_SIZE = 16384  # bytes given to OpenSSL at a time, one TLS record
+IP_ADDRESS = re.compile(r'^[0-9.]+$|:')  # no SNI for these, like the ssl module
+
+
+
+STDLIB_CONTEXT = None  # see stdlib_context()
+
+
+def stdlib_context():
+    # the ssl context of all connections, verifying certificates and host names like urllib2 does.
+    # made on the first HTTPS connection, so HTTP-only tests don't load the CA certificates.
+    # None before python 2.7.9, which has no contexts: connections are wrapped the old way, without verification
+    global STDLIB_CONTEXT
+    if STDLIB_CONTEXT is None and hasattr(ssl, 'create_default_context'):
+        STDLIB_CONTEXT = ssl.create_default_context(cafile=TLS_CA_FILE)
+    return STDLIB_CONTEXT
+
+
+def openssl_context():
+    context = OpenSSL.SSL.Context(OpenSSL.SSL.SSLv23_METHOD)
+    context.set_options(OpenSSL.SSL.OP_NO_SSLv2 | OpenSSL.SSL.OP_NO_SSLv3 | OpenSSL.SSL.OP_NO_COMPRESSION)
+    context.set_verify(OpenSSL.SSL.VERIFY_PEER, lambda connection, cert, errnum, depth, ok: ok)
+    if TLS_CA_FILE:
+        context.load_verify_locations(TLS_CA_FILE)
+    else:
+        context.set_default_verify_paths()
+    return context
+
+
+def openssl_session_reused():
+    # OpenSSL's SSL_session_reused, or None.  pyOpenSSL has no public call for it, so we look for it in its internals
+    try:
+        from OpenSSL._util import lib
+        return lib.SSL_session_reused
+    except (ImportError, AttributeError):
+        return None
+
+
+OPENSSL_CONTEXT = None
+SSL_SESSION_REUSED = None
+if TLS_SESSION_CACHE:
+    if OpenSSL is None:
+        sys.stderr.write('WARNING: TLS_SESSION_CACHE needs pyOpenSSL, every TLS handshake will be a full one\n')
+    else:
+        OPENSSL_CONTEXT = openssl_context()  # shared by all connections, each agent keeps its own sessions
+        SSL_SESSION_REUSED = openssl_session_reused()
+        if SSL_SESSION_REUSED is None:
+            sys.stderr.write('WARNING: this pyOpenSSL version can not tell resumed TLS sessions from full handshakes\n')
+
+
+
+
+class SessionCache:
+    # the TLS sessions of one agent, by (host, port), resumed when it connects again
+    def __init__(self):
+        self.sessions = {}
+
+
+    def wrap_socket(self, sock, host, port, context=None, do_handshake=True):
+        # a TLSSocket offering our last session with host:port, or without the session cache an ssl.SSLSocket
+        # from context (default stdlib_context()).  with do_handshake=False the caller drives do_handshake()
+        # (the event engine, on a non-blocking socket)
+        if OPENSSL_CONTEXT is None:
+            context = context or stdlib_context()
+            if context is None:
+                return ssl.wrap_socket(sock, do_handshake_on_connect=do_handshake)
+            return context.wrap_socket(sock, server_hostname=host, do_handshake_on_connect=do_handshake)
+        tls_sock = TLSSocket(self, sock, host, port)
+        if do_handshake:
+            tls_sock.do_handshake()
+        return tls_sock
+
+
+    def save(self, host, port, session):
+        self.sessions[(host, port)] = session
+
+
+    def get(self, host, port):
+        return self.sessions.get((host, port))
+
+
+
+
+def is_resumed(sock):
+    # did the handshake of a TLS socket resume a session.  None when we can't tell
+    return getattr(sock, 'resumed', False)
+
+
+
+
+class TLSSocket:
+    # a pyOpenSSL connection that behaves like an ssl.SSLSocket.  on a non-blocking socket it raises
+    # ssl.SSLWantReadError/SSLWantWriteError, otherwise it waits for the socket up to its timeout.
+    # its session is saved in the agent's SessionCache when it is closed
+    def __init__(self, sessions, sock, host, port):
+        self.sessions = sessions
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.connection = OpenSSL.SSL.Connection(OPENSSL_CONTEXT, sock)
+        if not IP_ADDRESS.search(host):
+            self.connection.set_tlsext_host_name(host)
+        session = sessions.get(host, port)
+        if session is not None:
+            self.connection.set_session(session)
+        self.connection.set_connect_state()
+        self.handshake_done = False
+        self.resumed = False
+        self.makefile_refs = 0  # httplib reads responses through makefile()
+        self.closed = False
+
+
+    def fileno(self):
+        return self.sock.fileno()
+
+
+    def gettimeout(self):
+        return self.sock.gettimeout()
+
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+
+    def do_handshake(self):
+        self.call(self.connection.do_handshake)
+        self.handshake_done = True
+        self.resumed = session_reused(self.connection)
+        ssl.match_hostname(peer_certificate(self.connection), self.host)
+
+
+    def pending(self):
+        return self.connection.pending()
+
+
+    def recv(self, bufsize, flags=0):
+        try:
+            return self.call(self.connection.recv, bufsize)
+        except ssl.SSLZeroReturnError:
+            return ''
+        except socket.error, e:
+            if e.args[0] == -1:  # the server closed the connection without a close_notify.  a plain socket reports eof too
+                return ''
+            raise
+
+
+    def send(self, data, flags=0):
+        return self.call(self.connection.send, str(data[:SEND_SIZE]))
+
+
+    def sendall(self, data, flags=0):
+        sent = 0
+        while sent < len(data):
+            sent += self.send(buffer(data, sent, SEND_SIZE))
+
+
+    def makefile(self, mode='r', bufsize=-1):
+        # same as ssl.SSLSocket: the connection stays open until the file and the socket are both closed
+        self.makefile_refs += 1
+        return socket._fileobject(self, mode, bufsize, close=True)
+
+
+    def close(self):
+        if self.closed:
+            return
+        if self.handshake_done:
+            # TLS 1.3 tickets arrive after the handshake, so the session to resume is taken at the end.
+            # urllib2 only closes the response file, the connection itself is left to the garbage collector
+            session = self.connection.get_session()
+            if session is not None:
+                self.sessions.save(self.host, self.port, session)
+        if self.makefile_refs > 0:
+            self.makefile_refs -= 1
+            return
+        self.closed = True
+        self.quiet_shutdown()
+        self.sock.close()
+
+
+    def __del__(self):
+        self.quiet_shutdown()
+
+
+    def quiet_shutdown(self):
+        # OpenSSL drops the session of a connection freed without a shutdown, as if the connection had failed.
+        # like ssl.SSLSocket we don't send close_notify, we only mark the connection as shut down
+        if self.handshake_done:
+            self.connection.set_shutdown(OpenSSL.SSL.SENT_SHUTDOWN | OpenSSL.SSL.RECEIVED_SHUTDOWN)
+
+
+    def call(self, method, *args):
+        # retry a pyOpenSSL call until the socket is ready, like ssl.SSLSocket.
+        # its errors are raised as the ssl and socket errors the callers already handle
+        while True:
+            try:
+                return method(*args)
+            except OpenSSL.SSL.WantReadError:
+                self.wait(ssl.SSLWantReadError, True)
+            except OpenSSL.SSL.WantWriteError:
+                self.wait(ssl.SSLWantWriteError, False)
+            except OpenSSL.SSL.ZeroReturnError:
+                raise ssl.SSLZeroReturnError('TLS/SSL connection has been closed (EOF)')
+            except OpenSSL.SSL.SysCallError, e:
+                raise socket.error(*e.args)
+            except OpenSSL.SSL.Error, e:
+                raise ssl.SSLError(str(e))
+
+
+    def wait(self, error, for_read):
+        timeout = self.sock.gettimeout()
+        if timeout == 0.0:  # non-blocking.  the event loop calls us again when the socket is ready
+            raise error('The operation did not complete')
+        if for_read:
+            ready = select.select([self.sock], [], [], timeout)[0]
+        else:
+            ready = select.select([], [self.sock], [], timeout)[1]
+        if not ready:
+            raise socket.timeout('timed out')
+
+
+
+
+def session_reused(connection):
+    # True or False, or None when this pyOpenSSL doesn't let us ask
+    ssl_handle = getattr(connection, '_ssl', None)
+    if SSL_SESSION_REUSED is None or ssl_handle is None:
+        return None
+    return bool(SSL_SESSION_REUSED(ssl_handle))
+
+
+def peer_certificate(connection):
+    # the server certificate in the form ssl.match_hostname takes
+    from cryptography import x509
+    cert = connection.get_peer_certificate().to_cryptography()
+    subject = tuple([(('commonName', attr.value),) for attr in cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)])
+    alt_names = []
+    try:
+        san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        alt_names.extend([('DNS', name) for name in san.get_values_for_type(x509.DNSName)])
+        alt_names.extend([('IP Address', str(ip)) for ip in san.get_values_for_type(x509.IPAddress)])
+    except x509.ExtensionNotFound:
+        pass
+    return {'subject': subject, 'subjectAltName': tuple(alt_names)}
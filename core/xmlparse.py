@@ -80,6 +80,7 @@ def load_xml_cases_dom(dom):
                 if element.tag.lower() == 'add_header':
                     headers.append(element.text)
             req = resolve_parameters(req, headers, param_map)  # substitute vars
+            req.freeze()
             cases.append(req)
     return cases
 
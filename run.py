@@ -27,6 +27,10 @@
   -b, --blocking              :  blocking mode
   -g, --gui                   :  start GUI
   -p, --port=PORT             :  xml-rpc listening port  
+  -c, --controller=NODES      :  run on xml-rpc nodes (comma-separated host/port pairs) and merge their results
+  -e, --engine=ENGINE         :  engine mode (threads or events)
+  -w, --workers=PROCESSES     :  number of worker processes
+  -t, --rate=REQS_PER_SEC     :  arrival rate (open workload model)
 """
 
 
@@ -50,6 +54,9 @@ test_name = config.TEST_NAME
 log_msgs = config.LOG_MSGS
 blocking = config.BLOCKING
 gui = config.GUI
+engine = config.ENGINE
+workers = config.WORKER_PROCESSES
+arrival_rate = config.ARRIVAL_RATE
 
 
 # parse command line arguments
@@ -82,11 +89,29 @@ try:
         gui = True
     if opt.port:
         port = int(opt.port)
+    if opt.controller:
+        nodes = [node.strip() for node in opt.controller.split(',') if node.strip()]
+        if not nodes:
+            raise ValueError(opt.controller)
+    if opt.engine:
+        if opt.engine not in ('threads', 'events'):
+            raise ValueError(opt.engine)
+        engine = opt.engine
+    if opt.workers:
+        workers = int(opt.workers)
+    if opt.rate:
+        arrival_rate = float(opt.rate)
 except Exception, e:
    print 'Invalid Argument'
    sys.exit(1)
 
 
+# read by core.engine when the UI below imports it
+config.ENGINE = engine
+config.WORKER_PROCESSES = workers
+config.ARRIVAL_RATE = arrival_rate
+
+
 if gui:  # gui mode
     import ui.gui as pylot_gui
     pylot_gui.main(agents, rampup, interval, duration, tc_xml_filename, 
@@ -94,13 +119,16 @@ if gui:  # gui mode
 
 
 elif opt.port:  # xml-rpc listener mode   
+    if not config.ROLLUP_INTERVAL:
+        config.ROLLUP_INTERVAL = 1  # a controller merges the results of its nodes from their rollups
     import SimpleXMLRPCServer
     import ui.blocking as pylot_blocking
-    class RemoteStarter:
+    from core.distributed import NodeServer
+    class RemoteStarter(NodeServer):  # also takes tests from a controller (see core/distributed.py)
         def start(self):
             return pylot_blocking.main(agents, rampup, interval, duration, 
                 tc_xml_filename, log_msgs, output_dir, test_name)
-    rs = RemoteStarter()
+    rs = RemoteStarter(output_dir, test_name)
     host = os.uname()[1]
     server = SimpleXMLRPCServer.SimpleXMLRPCServer((host, port))
     server.register_instance(rs)
@@ -109,6 +137,28 @@ elif opt.port:  # xml-rpc listener mode
     server.serve_forever()
 
 
+elif opt.controller:  # distributed mode: the test runs on the nodes, the results are merged here
+    from core.distributed import Controller
+    print '\n-------------------------------------------------'
+    print 'Test parameters:'
+    print '  nodes:                     %s' % ', '.join(nodes)
+    print '  number of agents:          %s' % agents
+    print '  test duration in seconds:  %s' % duration
+    print '  rampup in seconds:         %s' % rampup
+    print '  interval in milliseconds:  %s' % interval
+    print '  test case xml:             %s' % tc_xml_filename
+    print '\n'
+    controller = Controller(nodes, agents, rampup, interval, duration, tc_xml_filename, output_dir, test_name)
+    try:
+        controller.run()
+    except KeyboardInterrupt:
+        print '\nInterrupt'
+        sys.exit(1)
+    except Exception, e:
+        print 'ERROR: distributed test failed: %s' % e
+        sys.exit(1)
+
+
 elif blocking:  # blocked output mode (stdout blocked until test finishes, then result is returned)
     import ui.blocking as pylot_blocking
     try:    
@@ -129,6 +179,11 @@ else:  # console/shell mode
     print '  interval in milliseconds:  %s' % interval
     print '  test case xml:             %s' % tc_xml_filename
     print '  log messages:              %s' % log_msgs
+    print '  engine:                    %s' % engine
+    if workers > 1:
+        print '  worker processes:          %s' % workers
+    if arrival_rate:
+        print '  arrival rate (req/sec):    %s' % arrival_rate
     if test_name:
         print '  test name:                 %s' % test_name
     if output_dir:
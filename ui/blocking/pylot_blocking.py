@@ -20,7 +20,7 @@ import sys
 import time
 import core.xmlparse as xmlparse
 import core.config as config
-from core.engine import LoadManager
+from core.engine import ErrorQueue, LoadManager, snapshot_stats
 
 
 
@@ -35,7 +35,7 @@ def main(num_agents, rampup, interval, duration, tc_xml_filename, log_msgs, outp
         sys.stderr = open(os.devnull, 'w')
     
     runtime_stats = {}
-    error_queue = []
+    error_queue = ErrorQueue()
     
     interval = interval / 1000.0  # convert from millisecs to secs
    
@@ -72,6 +72,7 @@ def main(num_agents, rampup, interval, duration, tc_xml_filename, log_msgs, outp
     while lm.results_gen.isAlive():
         time.sleep(.10)
     
+    runtime_stats = snapshot_stats(runtime_stats)
     ids = runtime_stats.keys()
     agg_count = sum([runtime_stats[id].count for id in ids])  # total req count
     agg_total_latency = sum([runtime_stats[id].total_latency for id in ids])
@@ -19,7 +19,7 @@ import time
 from threading import Thread
 import core.xmlparse as xmlparse
 import core.config as config
-from core.engine import LoadManager
+from core.engine import ErrorQueue, LoadManager, LatencyTracker, format_percentiles, snapshot_stats
 
 
 
@@ -86,10 +86,12 @@ class ProgressBar:
 
 
 class RuntimeReporter(object):
-    def __init__(self, duration, runtime_stats):
+    def __init__(self, duration, runtime_stats, results_queue=None):
         self.runtime_stats = runtime_stats
+        self.results_queue = results_queue
         self.progress_bar = ProgressBar(duration)
         self.last_count = 0  # requests since last refresh
+        self.latency_tracker = LatencyTracker()
         self.refreshed_once = False  # just to know if we should move the cursor up
         
         
@@ -105,11 +107,13 @@ class RuntimeReporter(object):
             
             
     def refresh(self, elapsed_secs, refresh_rate):
-        ids = self.runtime_stats.keys()
-        agg_count = sum([self.runtime_stats[id].count for id in ids])  # total req count
-        agg_total_latency = sum([self.runtime_stats[id].total_latency for id in ids])
-        agg_error_count = sum([self.runtime_stats[id].error_count for id in ids])
-        total_bytes_received = sum([self.runtime_stats[id].total_bytes for id in ids])
+        runtime_stats = snapshot_stats(self.runtime_stats)
+        ids = runtime_stats.keys()
+        agg_count = sum([runtime_stats[id].count for id in ids])  # total req count
+        agg_total_latency = sum([runtime_stats[id].total_latency for id in ids])
+        agg_error_count = sum([runtime_stats[id].error_count for id in ids])
+        total_bytes_received = sum([runtime_stats[id].total_bytes for id in ids])
+        total_latencies, window_latencies = self.latency_tracker.update(runtime_stats)
         
         if agg_count > 0 and elapsed_secs > 0:
             avg_resp_time = agg_total_latency / agg_count  # avg response time since start
@@ -119,19 +123,25 @@ class RuntimeReporter(object):
             self.last_count = agg_count  # reset for next time
             
             if self.refreshed_once:
-                self.move_up(10)  # move the cursor up x times
+                self.move_up(13)  # move the cursor up x times
             self.progress_bar.update_time(elapsed_secs)    
             print self.progress_bar
-            print '\nRequests:  %d\nErrors: %i\nAvg Response Time:  %.3f\nAvg Throughput:  %.2f\nCurrent Throughput:  %i\nBytes Received:  %d\n%s' % (
-                agg_count, agg_error_count, avg_resp_time, avg_throughput, cur_throughput, total_bytes_received, 
-                '\n-------------------------------------------------')        
+            if self.results_queue:
+                results_line = 'Results Queue:  %d  (writer lag %.1fs, dropped %d)  ' % (
+                    self.results_queue.qsize(), self.results_queue.lag(), self.results_queue.dropped)
+            else:
+                results_line = ''
+            print '\nRequests:  %d\nErrors: %i\nAvg Response Time:  %.3f\nResponse Time 50/95/99%%:  %s  \nLast %.1fs 50/95/99%%:  %s  \nAvg Throughput:  %.2f\nCurrent Throughput:  %i\nBytes Received:  %d\n%s\n%s' % (
+                agg_count, agg_error_count, avg_resp_time, format_percentiles(total_latencies), refresh_rate, 
+                format_percentiles(window_latencies), avg_throughput, cur_throughput, total_bytes_received, 
+                results_line, '\n-------------------------------------------------')        
             self.refreshed_once = True
         
 
 
 def main(num_agents, rampup, interval, duration, tc_xml_filename, log_msgs, output_dir=None, test_name=None):
     runtime_stats = {}
-    error_queue = []
+    error_queue = ErrorQueue()
     interval = interval / 1000.0  # convert from millisecs to secs
     
     # create a load manager
@@ -152,7 +162,7 @@ def main(num_agents, rampup, interval, duration, tc_xml_filename, log_msgs, outp
     lm.setDaemon(True)
     lm.start()
     
-    reporter = RuntimeReporter(duration, runtime_stats)
+    reporter = RuntimeReporter(duration, runtime_stats, lm.results_queue)
     while (time.time() < start_time + duration):         
         refresh_rate = 0.5
         time.sleep(refresh_rate)        
@@ -34,7 +34,7 @@ class Application(wx.Frame):
         wx.Frame.__init__(self, parent, -1, 'Pylot - Web Performance  |  Version ' + VERSION, size=(690, 710))
     
         self.runtime_stats = {}  # shared runtime stats dictionary
-        self.error_queue = []  # shared error list
+        self.error_queue = ErrorQueue()  # shared error list
         
         self.tc_xml_filename = tc_xml_filename
         self.output_dir = output_dir
@@ -119,6 +119,9 @@ class Application(wx.Frame):
         self.total_statlist.InsertColumn(4, 'Avg Resp Time', width=95)
         self.total_statlist.InsertColumn(5, 'Avg Throughput', width=100)
         self.total_statlist.InsertColumn(6, 'Cur Throughput', width=100)
+        self.total_statlist.InsertColumn(7, 'Resp Time 50/95/99 %', width=145)
+        self.total_statlist.InsertColumn(8, 'Last Refresh 50/95/99 %', width=145)
+        self.total_statlist.InsertColumn(9, 'Results Queue (lag, dropped)', width=170)
         
         agent_monitor_text = wx.StaticText(panel, -1, 'Agent Monitor')
         agent_monitor_text.SetFont(wx.Font(8, wx.DEFAULT, wx.NORMAL, wx.NORMAL))
@@ -195,7 +198,7 @@ class Application(wx.Frame):
     def on_run(self, evt):
         # reset stats and errors in case there was a previous run since startup
         self.runtime_stats = {}
-        self.error_queue = []
+        self.error_queue = ErrorQueue()
         
         # get values from UI controls
         num_agents = self.num_agents_spin.GetValue()
@@ -236,7 +239,7 @@ class Application(wx.Frame):
             self.stopper.setDaemon(True)
             self.stopper.start()
             
-            self.rt_mon = RTMonitor(self.start_time, self.runtime_stats, self.error_queue, self.agents_statlist, self.total_statlist, self.error_list)
+            self.rt_mon = RTMonitor(self.start_time, self.runtime_stats, self.error_queue, self.agents_statlist, self.total_statlist, self.error_list, self.lm.results_queue)
             self.rt_mon.error_list.Clear()
             
             self.rt_mon.setDaemon(True)
@@ -259,7 +262,7 @@ class Application(wx.Frame):
         self.pause_btn.Enable()
         self.resume_btn.Disable()
         
-        self.rt_mon = RTMonitor(self.start_time, self.runtime_stats, self.error_queue, self.agents_statlist, self.total_statlist, self.error_list)
+        self.rt_mon = RTMonitor(self.start_time, self.runtime_stats, self.error_queue, self.agents_statlist, self.total_statlist, self.error_list, self.lm.results_queue)
         self.rt_mon.setDaemon(True)
         self.rt_mon.start()
         
@@ -342,12 +345,13 @@ class AutoWidthListCtrl(wx.ListCtrl, ListCtrlAutoWidthMixin):
 
 
 class RTMonitor(Thread):  # real time monitor.  runs in its own thread so we don't block UI events 
-    def __init__(self, start_time, runtime_stats, error_queue, agents_statlist, total_statlist, error_list):
+    def __init__(self, start_time, runtime_stats, error_queue, agents_statlist, total_statlist, error_list, results_queue=None):
         Thread.__init__(self)
         
         # references to shared data stores         
         self.runtime_stats = runtime_stats
         self.error_queue = error_queue
+        self.results_queue = results_queue
         
         # references to list widgets
         self.agents_statlist = agents_statlist  
@@ -361,6 +365,7 @@ class RTMonitor(Thread):  # real time monitor.  runs in its own thread so we don
     def run(self):
         self.running = True
         self.last_count = 0  # to calc current throughput
+        self.latency_tracker = LatencyTracker()  # for percentiles since start and since last refresh
         while self.running:
             self.refresh()
             # sleep until next refresh    
@@ -370,12 +375,14 @@ class RTMonitor(Thread):  # real time monitor.  runs in its own thread so we don
     def refresh(self):
         # refresh total monitor
         elapsed_secs = int(time.time() - self.start_time)  # running time in secs
-        ids = self.runtime_stats.keys()
-        
-        agents_running = '%d/%d' % (len([self.runtime_stats[id].count for id in ids if self.runtime_stats[id].count > 0]), len(ids))
-        agg_count = sum([self.runtime_stats[id].count for id in ids])  # total req count
-        agg_total_latency = sum([self.runtime_stats[id].total_latency for id in ids])
-        agg_error_count = sum([self.runtime_stats[id].error_count for id in ids])
+        runtime_stats = snapshot_stats(self.runtime_stats)
+        ids = runtime_stats.keys()
+        total_latencies, window_latencies = self.latency_tracker.update(runtime_stats)
+        
+        agents_running = '%d/%d' % (len([runtime_stats[id].count for id in ids if runtime_stats[id].count > 0]), len(ids))
+        agg_count = sum([runtime_stats[id].count for id in ids])  # total req count
+        agg_total_latency = sum([runtime_stats[id].total_latency for id in ids])
+        agg_error_count = sum([runtime_stats[id].error_count for id in ids])
         if agg_count > 0 and elapsed_secs > 0:
             avg_resp_time = agg_total_latency / agg_count  # avg response time since start
             throughput = float(agg_count) / elapsed_secs  # avg throughput since start
@@ -394,11 +401,16 @@ class RTMonitor(Thread):  # real time monitor.  runs in its own thread so we don
         self.total_statlist.SetStringItem(index, 4, '%.3f' % avg_resp_time)
         self.total_statlist.SetStringItem(index, 5, '%.3f' % throughput)
         self.total_statlist.SetStringItem(index, 6, '%.3f' % cur_throughput)
+        self.total_statlist.SetStringItem(index, 7, format_percentiles(total_latencies))
+        self.total_statlist.SetStringItem(index, 8, format_percentiles(window_latencies))
+        if self.results_queue:
+            self.total_statlist.SetStringItem(index, 9, '%d  (%.1fs, %d)' % (
+                self.results_queue.qsize(), self.results_queue.lag(), self.results_queue.dropped))
         
         # refresh agents monitor
         self.agents_statlist.DeleteAllItems()       
-        for id in self.runtime_stats.keys():
-            count = self.runtime_stats[id].count
+        for id in ids:
+            count = runtime_stats[id].count
             index = self.agents_statlist.InsertStringItem(sys.maxint, '%d' % (id + 1))
             self.agents_statlist.SetStringItem(index, 2, '%d' % count)
             if count == 0:
@@ -408,15 +420,15 @@ class RTMonitor(Thread):  # real time monitor.  runs in its own thread so we don
                 self.agents_statlist.SetStringItem(index, 5, '-')
             else:
                 self.agents_statlist.SetStringItem(index, 1, 'running')
-                self.agents_statlist.SetStringItem(index, 3, '%.3f' % self.runtime_stats[id].latency)
-                self.agents_statlist.SetStringItem(index, 4, '%.3f' % self.runtime_stats[id].avg_latency)
-                self.agents_statlist.SetStringItem(index, 5, '%d' % self.runtime_stats[id].total_bytes)
+                self.agents_statlist.SetStringItem(index, 3, '%.3f' % runtime_stats[id].latency)
+                self.agents_statlist.SetStringItem(index, 4, '%.3f' % runtime_stats[id].avg_latency)
+                self.agents_statlist.SetStringItem(index, 5, '%d' % runtime_stats[id].total_bytes)
         self.agents_statlist.resizeLastColumn(80)  # avoid horizontal scrollbar
         
         # refresh error monitor            
-        for error in self.error_queue:
-            # pop error strings off the queue and render them in the monitor
-            self.error_list.AppendText('%s\n' % self.error_queue.pop(0))
+        for error in self.error_queue.drain():
+            # take the error strings off the queue and render them in the monitor
+            self.error_list.AppendText('%s\n' % error)
         self.error_list.ShowPosition(self.error_list.GetLastPosition()) # scroll to end 
         
         